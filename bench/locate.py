@@ -0,0 +1,99 @@
+"""
+Checks and times csdllib.methods.spatial.ElementIndex.locate and
+PointIndex.nearest against brute force, on a graded Delaunay mesh:
+large elements next to a refined zone are where the nearest-node 
+candidates miss the containing element, and where a bin grid sized
+for the mean density of the nodes is far too fine or too coarse.
+
+Usage:
+    python bench/locate.py [nq] [nFine]
+"""
+import sys
+import time
+import numpy as np
+import matplotlib.tri as mtri
+from csdllib.models.grid import Grid
+from csdllib.methods import spatial
+
+#==============================================================================
+def gradedMesh (nFine=20000, nCoarse=400, seed=0):
+    """
+    Delaunay mesh of a dense cluster of nodes inside sparse ones
+    """
+    rng = np.random.default_rng(seed)
+    lon = np.concatenate((rng.uniform(-75.2, -74.8, nFine),
+                          rng.uniform(-80., -70., nCoarse)))
+    lat = np.concatenate((rng.uniform( 34.8,  35.2, nFine),
+                          rng.uniform( 30.,  40., nCoarse)))
+    tri = mtri.Triangulation(lon, lat)
+    return {'lon' : lon, 'lat' : lat, 'Elements' : tri.triangles + 1}, tri
+
+#==============================================================================
+def bruteLocate (grid, xq, yq, eps=1e-9, chunk=200):
+    """
+    Tests every element for every query point
+    """
+    xt = grid.lon[grid.elements]
+    yt = grid.lat[grid.elements]
+    inside = np.zeros(len(xq), dtype=bool)
+    for q0 in range(0, len(xq), chunk):
+        for q in range(q0, min(q0 + chunk, len(xq))):
+            w = spatial.barycentric(np.full(grid.NE, xq[q]),
+                                    np.full(grid.NE, yq[q]), xt, yt)
+            inside[q] = np.any(np.min(w, axis=1) >= -eps)
+    return inside
+
+#==============================================================================
+def bruteNearest (grid, xq, yq, k, geographic=False, chunk=16):
+    """
+    Distances to the k nearest nodes, from the distances to every node
+    """
+    if geographic:
+        p, q = spatial.toSphere(grid.lon, grid.lat), spatial.toSphere(xq, yq)
+    else:
+        p, q = np.column_stack((grid.lon, grid.lat)), np.column_stack((xq, yq))
+    dist = np.zeros([len(q), k])
+    for q0 in range(0, len(q), chunk):
+        d = np.sqrt(np.sum((q[q0:q0+chunk, None, :] - p[None])**2, axis=-1))
+        dist[q0:q0+chunk] = np.sort(np.partition(d, k-1, axis=1)[:, :k], axis=1)
+    return spatial.chordToMeters(dist) if geographic else dist
+
+#==============================================================================
+if __name__ == '__main__':
+
+    nq    = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    nFine = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    mesh, tri = gradedMesh(nFine, nFine // 50)
+    grid = Grid(mesh)
+    rng  = np.random.default_rng(1)
+    xq   = rng.uniform(-80., -70., nq)
+    yq   = rng.uniform( 30.,  40., nq)
+
+    t0 = time.time()
+    elems, nodes, weights = grid.locate(xq, yq)
+    tLocate = time.time() - t0
+    inside  = bruteLocate(grid, xq, yq)
+
+    found = elems >= 0
+    assert np.array_equal(found, inside), \
+        str(np.count_nonzero(inside & ~found)) + ' inside points missed'
+    assert np.array_equal(found, tri.get_trifinder()(xq, yq) >= 0)
+    assert np.allclose(np.sum(weights[found], axis=1), 1.)
+    assert np.all(np.min(weights[found], axis=1) >= -1e-9)
+    assert np.allclose(np.sum(weights[found]*grid.lon[nodes[found]], axis=1),
+                       xq[found])
+    print('inside points : %d of %d' % (np.count_nonzero(found), nq))
+    print('locate        : %8.3f s' % tLocate)
+
+    # queries over the whole mesh and at its nodes (mostly refined zone)
+    nodes = rng.choice(grid.NP, nq)
+    for name, x, y in (('area', xq, yq), 
+                       ('nodes', grid.lon[nodes], grid.lat[nodes])):
+        for geographic in (False, True):
+            index = grid.sphereIndex if geographic else grid.pointIndex
+            t0 = time.time()
+            dist, near = index.nearest(x, y, k=8)
+            tNearest = time.time() - t0
+            assert np.allclose(dist, bruteNearest(grid, x, y, 8, geographic))
+            print('nearest %-5s : %8.3f s%s' % (name, tNearest, 
+                  ' (geographic)' if geographic else ''))
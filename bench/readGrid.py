@@ -0,0 +1,86 @@
+"""
+Benchmarks line-by-line and bulk parsing of ADCIRC fort.14 files
+(csdllib.models.adcirc.readGrid), and loading from the grid cache,
+on a synthetic structured mesh.
+
+Usage:
+    python bench/readGrid.py [nx] [ny]
+"""
+import os
+import sys
+import shutil
+import time
+import tempfile
+import numpy as np
+from csdllib.models import adcirc
+
+#==============================================================================
+def writeSyntheticGrid (gridFile, nx=1000, ny=1000):
+    """
+    Writes a triangulated nx by ny regular mesh with one open boundary,
+    one land boundary and one weir (IBTYPE=24) boundary
+    """
+    lon, lat = np.meshgrid(np.linspace(-80., -70., nx),
+                           np.linspace( 30.,  40., ny))
+    depth = np.random.uniform(-5., 500., nx*ny)
+    nodes = np.arange(nx*ny).reshape(ny, nx) + 1
+    n00 = nodes[:-1,:-1].ravel()
+    n10 = nodes[:-1, 1:].ravel()
+    n01 = nodes[ 1:,:-1].ravel()
+    n11 = nodes[ 1:, 1:].ravel()
+    elements = np.vstack((np.column_stack((n00, n10, n11)),
+                          np.column_stack((n00, n11, n01))))
+    NP = nx*ny
+    NE = len(elements)
+
+    with open(gridFile, 'w') as f:
+        f.write('synthetic mesh\n')
+        f.write(str(NE) + ' ' + str(NP) + '\n')
+        np.savetxt(f, np.column_stack((np.arange(1, NP+1),
+                                       lon.ravel(), lat.ravel(), depth)),
+                   fmt='%d %.8f %.8f %.4f')
+        np.savetxt(f, np.column_stack((np.arange(1, NE+1),
+                                       3*np.ones(NE, dtype=int), elements)),
+                   fmt='%d')
+        f.write('1 = Number of open boundaries\n')
+        f.write(str(ny) + ' = Total number of open boundary nodes\n')
+        f.write(str(ny) + ' 0\n')
+        np.savetxt(f, nodes[:,0], fmt='%d')
+        f.write('2 = Number of land boundaries\n')
+        f.write(str(nx+10) + ' = Total number of land boundary nodes\n')
+        f.write(str(nx) + ' 20\n')
+        np.savetxt(f, nodes[-1,:], fmt='%d')
+        f.write('10 24\n')
+        for n in range(10):
+            f.write('%d %d 1.5 1.0 1.0\n' % (nodes[0,n+1], nodes[1,n+1]))
+
+#==============================================================================
+def timeIt (func, *args, **kwargs):
+    t0  = time.time()
+    out = func(*args, **kwargs)
+    return time.time() - t0, out
+
+#==============================================================================
+if __name__ == '__main__':
+
+    nx = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    ny = int(sys.argv[2]) if len(sys.argv) > 2 else nx
+
+    gridFile = os.path.join(tempfile.mkdtemp(), 'fort.14')
+    writeSyntheticGrid (gridFile, nx, ny)
+    print('Synthetic mesh: NP=' + str(nx*ny) + ', ' +
+          str(os.path.getsize(gridFile)//2**20) + ' MB')
+
+    tLine, gLine = timeIt(adcirc.readGrid, gridFile, verbose=0)
+    tBulk, gBulk = timeIt(adcirc.readGrid, gridFile, verbose=0, bulk=True)
+    adcirc.readGrid(gridFile, verbose=0, bulk=True, cache=True)
+    tCache, gCache = timeIt(adcirc.readGrid, gridFile, verbose=0, cache=True)
+
+    for key in gLine:
+        assert np.array_equal(gLine[key], gBulk[key]), key
+        assert np.array_equal(gLine[key], gCache[key]), key
+    print('line-by-line : %8.2f s' % tLine)
+    print('bulk         : %8.2f s' % tBulk)
+    print('speedup      : %8.1fx' % (tLine/tBulk))
+    print('cached       : %8.2f s' % tCache)
+    shutil.rmtree(os.path.dirname(gridFile))
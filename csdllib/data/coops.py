@@ -334,5 +334,29 @@ def createAnomalyTable (csvFile, dates):
             oper.sys.msg( 'warn','Failed to read ' + str(nos_id))
             
     f.close()
-    oper.sys.msg( 'i','Elapsed time: ' +(datetime.utcnow()-rightNow).seconds +' sec')
+    oper.sys.msg( 'i','Elapsed time: ' + 
+                  str((datetime.utcnow()-rightNow).seconds) +' sec')
+
+#==============================================================================
+def readAnomalyTable (csvFile):
+    """
+    Reads the table written by createAnomalyTable
+    Returns:
+        dict: 'nosid', 'nwsid' (lists), 'lon', 'lat', 'bias', 'days' (np.arrays)
+    """
+    table = {'nosid' : [], 'nwsid' : [], 
+             'lon'   : [], 'lat'   : [], 'bias' : [], 'days' : []}
+    with open(csvFile) as f:
+        next(f, None)
+        for line in f:
+            row = [x.strip() for x in line.split(',')]
+            if len(row) < 6:
+                continue
+            table['nosid'].append(row[0])
+            table['nwsid'].append(row[1])
+            for key, val in zip(('lon','lat','bias','days'), row[2:6]):
+                table[key].append(float(val))
+    for key in ('lon','lat','bias','days'):
+        table[key] = np.array(table[key])
+    return table
     
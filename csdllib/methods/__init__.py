@@ -1,5 +1,6 @@
 from . import interp
 from . import statistics
 from . import convert
-__all__ = ['interp','statistics','convert']
-
+from . import spatial
+from . import events
+__all__ = ['interp','statistics','convert','spatial','events']
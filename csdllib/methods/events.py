@@ -0,0 +1,272 @@
+"""
+Event statistics (flood level exceedances, peaks, contingency tables)
+for many stations at once
+
+@author: Sergey.Vinogradov@noaa.gov
+"""
+import numpy as np
+from csdllib import oper
+from csdllib.methods import statistics
+
+LEVELS = [('minor',    'fl_minor_ft'),
+          ('moderate', 'fl_moder_ft'),
+          ('major',    'fl_major_ft')]
+
+#==============================================================================
+def floodThresholds (datums, floodlevels, zero='MSL'):
+    """
+    Converts NOS CO-OPS flood levels (ft above MHHW, as returned by
+    data.parse.datumsAndLevels) into meters above 'MSL' or 'MLLW',
+    the same way plot.series.set draws them.
+    Args:
+        datums, floodlevels : dicts of one station, or lists of them
+        zero (str)          : 'MSL' or 'MLLW'
+    Returns:
+        dict {'minor', 'moderate', 'major'} of floats (or np.arrays [NS]),
+        NaN where the level is not defined
+    """
+    single = isinstance(datums, dict)
+    if single:
+        datums, floodlevels = [datums], [floodlevels]
+    get = lambda dicts, key: np.array([d.get(key, np.nan) if d else np.nan
+                                       for d in dicts], dtype=float)
+    mhhw = get(datums, 'datum_mhhw_ft')
+    msl  = get(datums, 'datum_msl_ft')
+    if zero == 'MSL':
+        shift = 0.
+    elif zero == 'MLLW':
+        shift = msl - get(datums, 'datum_mllw_ft')
+    else:
+        oper.sys.msg('e', 'Unknown zero ' + str(zero) + ', use MSL or MLLW.')
+        return
+    levels = {}
+    for name, key in LEVELS:
+        level = 0.3048*(mhhw + get(floodlevels, key) - msl + shift)
+        levels[name] = level[0] if single else level
+    return levels
+
+#==============================================================================
+def _levels (thresholds, ns):
+    """
+    Returns level names and thresholds as np.array [NL, NS] from
+        a scalar or np.array [NS] (one level),
+        np.array [NL, NS],
+        a list or tuple of NL levels (scalar or [NS] each),
+        a dict {name : scalar or [NS]}
+    """
+    if isinstance(thresholds, dict):
+        names = list(thresholds.keys())
+        thresholds = [thresholds[name] for name in names]
+    else:
+        names = None
+        if not isinstance(thresholds, (list, tuple)):
+            thr = np.asarray(thresholds, dtype=float)
+            thresholds = list(thr) if thr.ndim == 2 else [thr]
+    # each level separately, so that scalars and [NS] arrays can be mixed
+    thr = np.array([np.broadcast_to(np.asarray(t, dtype=float), (ns,))
+                    for t in thresholds]).reshape(-1, ns)
+    if names is None:
+        names = list(range(len(thr)))
+    return names, thr
+
+#==============================================================================
+def _hours (dates):
+    """
+    Hours represented by each record: the interval since the previous one
+    (the first record gets the interval to the second), as in
+    models.adcirc.computeExtremes
+    """
+    t = statistics._asDatetime64(dates)
+    h = np.diff(t).astype(float) / 3.6e9
+    if not len(h):
+        return t, np.zeros(len(t))
+    return t, np.concatenate(([h[0]], h))
+
+#==============================================================================
+def _prepare (values, dates):
+    v = np.ma.filled(np.ma.asarray(values, dtype=float), np.nan)
+    v = v.reshape(len(v), -1)
+    t, hours = _hours(dates)
+    if len(t) != len(v):
+        oper.sys.msg('e', 'values and dates are not aligned.')
+        return None, None, None
+    return v, t, hours
+
+#==============================================================================
+def exceedance (values, dates, thresholds):
+    """
+    Time spent above each threshold, number of separate exceedance
+    events and time of the first exceedance, for all stations at once.
+    Args:
+        values (np.array [NT, NS]) : e.g. water levels projected on dates
+        dates ([NT])               : datetime or np.datetime64
+        thresholds : scalar or np.array [NS] (one level), np.array
+                     [NL, NS], list of NL levels (scalar or [NS] each),
+                     or floodThresholds() dict
+    Returns:
+        dict: 'levels' (names), and np.arrays [NL, NS]:
+              'hours'  (duration above the level),
+              'events' (number of times the level was crossed upwards),
+              'first'  (np.datetime64 of the first exceedance, or NaT),
+              'peak'   (maximum, NaN if the series is all missing)
+    """
+    v, t, hours = _prepare(values, dates)
+    if v is None:
+        return
+    names, thr = _levels(thresholds, v.shape[1])
+    with np.errstate(invalid='ignore'):
+        above = v[None] > thr[:, None, :]                       # [NL, NT, NS]
+    onset = above.copy()
+    onset[:, 1:] &= ~above[:, :-1]
+    anyAbove = above.any(axis=1)
+    first = np.where(anyAbove, t[np.argmax(above, axis=1)], 
+                     np.datetime64('NaT'))
+    valid = ~np.isnan(v)
+    peak  = np.where(valid.any(axis=0),
+                     np.max(np.where(valid, v, -np.inf), axis=0), np.nan)
+    return {'levels' : names,
+            'hours'  : np.einsum('lts,t->ls', above, hours),
+            'events' : np.count_nonzero(onset, axis=1),
+            'first'  : first,
+            'peak'   : np.broadcast_to(peak, thr.shape).copy()}
+
+#==============================================================================
+def detectPeaks (values, dates, threshold, minSeparationHours=0.):
+    """
+    Detects peaks of all stations at once as the maxima of events above
+    threshold. Events of a station separated by less than
+    minSeparationHours are merged into one (declustering).
+    Args:
+        values (np.array [NT, NS]) : e.g. water levels projected on dates
+        dates ([NT])               : datetime or np.datetime64
+        threshold                  : scalar or [NS] (e.g. a flood level
+                                     from floodThresholds())
+        minSeparationHours (float) : minimum time between two peaks
+    Returns:
+        dict of np.arrays [NE] (one item per event, ordered by station
+        and time): 'station' (column index), 'start', 'end', 'time'
+        (np.datetime64 of the peak), 'index' (record of the peak),
+        'value' (peak value), 'hours' (time above threshold)
+    """
+    v, t, hours = _prepare(values, dates)
+    if v is None:
+        return
+    nt, ns = v.shape
+    thr = np.broadcast_to(np.asarray(threshold, dtype=float), (ns,))
+    with np.errstate(invalid='ignore'):
+        above = (v > thr).T                                     # [NS, NT]
+    # runs of consecutive records above threshold, station by station
+    edges = np.diff(np.pad(above.astype(np.int8), ((0, 0), (1, 1))), axis=1)
+    station, start = np.nonzero(edges == 1)
+    end = np.nonzero(edges == -1)[1] - 1                         # inclusive
+    if len(start) and minSeparationHours > 0:
+        gap = (t[start[1:]] - t[end[:-1]]) / np.timedelta64(1, 'h')
+        new = np.concatenate(([True], (station[1:] != station[:-1]) |
+                                      (gap >= minSeparationHours)))
+        last  = np.concatenate((np.nonzero(new)[0][1:] - 1, [len(new) - 1]))
+        station, start, end = station[new], start[new], end[last]
+
+    # all events at once on the flattened [NS, NT] record: every segment
+    # from one event start to the next holds a single event
+    flat  = np.where(above, v.T, -np.inf).ravel()
+    f0    = station*nt + start
+    f1    = station*nt + end
+    value = np.maximum.reduceat(flat, f0) if len(f0) else np.zeros(0)
+    mark  = np.zeros(ns*nt + 1, dtype=int)
+    mark[f0] = 1
+    label = np.cumsum(mark[:-1]) - 1
+    value = np.append(value, np.nan)             # label -1: before events
+    pos   = np.nonzero(flat == value[label])[0]
+    pos   = pos[np.unique(label[pos], return_index=True)[1]]  # first maximum
+    value = value[:-1]
+    index = pos - station*nt
+    cumh  = np.concatenate(([0.], np.cumsum((above*hours).ravel())))
+    return {'station' : station,
+            'start'   : t[start],
+            'end'     : t[end],
+            'time'    : t[index],
+            'index'   : index,
+            'value'   : value,
+            'hours'   : cumh[f1 + 1] - cumh[f0]}
+
+#==============================================================================
+def _dilate (mask, halfWidth):
+    """
+    True where mask is True within +-halfWidth records (along axis 1)
+    """
+    if halfWidth <= 0:
+        return mask
+    nt = mask.shape[1]
+    c  = np.cumsum(mask, axis=1)
+    c  = np.concatenate((np.zeros_like(c[:, :1]), c), axis=1)
+    hi = np.minimum(np.arange(nt) + halfWidth + 1, nt)
+    lo = np.maximum(np.arange(nt) - halfWidth, 0)
+    return (c[:, hi] - c[:, lo]) > 0
+
+#==============================================================================
+def contingency (data, model, dates, thresholds, windowHours=0.,
+                 perSeries=False):
+    """
+    Hit / miss / false alarm contingency tables of model against data
+    exceedances of each threshold, for all stations (or forecasts) at once.
+    Records where either series is missing are not counted.
+    Args:
+        data, model (np.arrays [NT, NS]) : projected on the same dates
+        dates ([NT])                     : datetime or np.datetime64
+        thresholds : scalar or np.array [NS] (one level), np.array
+                     [NL, NS], list of NL levels (scalar or [NS] each),
+                     or floodThresholds() dict
+        windowHours (float) : a model (data) exceedance within this time
+                              of a data (model) exceedance counts as a hit
+                              (timing tolerance)
+        perSeries (bool)    : count each column as one yes/no event
+                              (e.g. one forecast) instead of each record
+    Returns:
+        dict: 'levels' (names), and np.arrays [NL, NS]:
+              'hits', 'misses', 'false_alarms', 'correct_negatives',
+              'pod' (hits/(hits+misses)), 'far' (false_alarms/(hits+
+              false_alarms)), 'csi' (hits/(hits+misses+false_alarms))
+    """
+    d, t, hours = _prepare(data, dates)
+    m = np.ma.filled(np.ma.asarray(model, dtype=float), np.nan)
+    if d is None or m.size != d.size:
+        oper.sys.msg('e', 'data and model are not aligned.')
+        return
+    m = m.reshape(d.shape)
+    names, thr = _levels(thresholds, d.shape[1])
+    valid = ~np.isnan(d) & ~np.isnan(m)
+    with np.errstate(invalid='ignore'):
+        obsYes = (d[None] > thr[:, None, :]) & valid            # [NL, NT, NS]
+        modYes = (m[None] > thr[:, None, :]) & valid
+    if perSeries:
+        obsYes  = obsYes.any(axis=1)
+        modYes  = modYes.any(axis=1)
+        counted = np.broadcast_to(valid.any(axis=0), obsYes.shape)
+        hits    = (obsYes & modYes).astype(int)
+        misses  = (obsYes & ~modYes).astype(int)
+        falses  = (~obsYes & modYes).astype(int)
+        nulls   = (~obsYes & ~modYes & counted).astype(int)
+    else:
+        step = np.median(hours[1:]) if len(hours) > 1 else 1.
+        half = int(round(windowHours / step)) if step > 0 else 0
+        nl, nt, ns = obsYes.shape
+        flat = lambda a: a.transpose(0, 2, 1).reshape(nl*ns, nt)
+        back = lambda a: a.reshape(nl, ns, nt).transpose(0, 2, 1)
+        obsNear = back(_dilate(flat(obsYes), half)) & valid
+        modNear = back(_dilate(flat(modYes), half)) & valid
+        hits   = np.count_nonzero(obsYes & modNear, axis=1)
+        misses = np.count_nonzero(obsYes & ~modNear, axis=1)
+        falses = np.count_nonzero(modYes & ~obsNear, axis=1)
+        nulls  = np.count_nonzero(valid & ~obsYes & ~modYes, axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        pod = hits / (hits + misses)
+        far = falses / (hits + falses)
+        csi = hits / (hits + misses + falses)
+    return {'levels'            : names,
+            'hits'              : hits,
+            'misses'            : misses,
+            'false_alarms'      : falses,
+            'correct_negatives' : nulls,
+            'pod'               : pod,
+            'far'               : far,
+            'csi'               : csi}
@@ -2,10 +2,13 @@
 @author: Sergey.Vinogradov@noaa.gov
 """
 
+import os
+import hashlib
 import numpy as np
 import datetime
-from datetime import timedelta
+from concurrent.futures import ProcessPoolExecutor
 from csdllib import oper
+from csdllib.methods import spatial
 
 #============================================================================== 
 def nearest(items, pivot):
@@ -64,6 +67,249 @@ def shepardIDW(x, y, v, xi, yi, p=2):
     return vi
 
 
+#==============================================================================
+def idwWeights(index, xi, yi, p=2, k=8, radius=None):
+    """
+    Computes IDW neighbors and normalized weights of grid points
+    Args:
+        index (spatial.PointIndex) : index of the data points
+        xi,  yi (float) : arrays for grid coordinates
+        p         (int) : scalar power
+        k         (int) : number of nearest data points (None: all 
+                          within radius)
+        radius  (float) : search radius (meters for a geographic index)
+    Returns:
+        near    (int   [NI, K]) : data point indices (-1 for no neighbor)
+        weights (float [NI, K]) : weights summing to 1 (0 for no neighbor),
+                                  exact hits get all of the weight
+    """
+    xi = np.asarray(xi, dtype=float)
+    nq = len(xi)
+    if k is None:
+        qid, dist, near = index.within(xi, yi, radius)
+        width = max(1, int(np.max(np.bincount(qid, minlength=1))))
+        dist, near = spatial._kSmallest(qid, dist, near, nq, width)
+    else:
+        k = max(1, min(k, len(index)))
+        dist, near = index.nearest(xi, yi, k)
+        dist = dist.reshape(nq, k)
+        near = near.reshape(nq, k)
+        if radius is not None:
+            far = dist > radius
+            dist[far] = np.inf
+            near[far] = -1
+    with np.errstate(divide='ignore'):
+        weights = 1.0/np.power(dist, p)
+    # exact hits take the data value
+    hit = dist == 0.
+    anyHit = hit.any(axis=1)
+    weights[anyHit] = hit[anyHit]
+    with np.errstate(invalid='ignore'):
+        weights /= np.sum(weights, axis=1)[:, None]
+    weights[near < 0] = 0.
+    return near, weights
+
+#==============================================================================
+_idwState = {}
+
+def _idwInit(x, y, v, geographic):
+    _idwState['index'] = spatial.PointIndex(x, y, geographic=geographic)
+    _idwState['v']     = v
+
+def _idwChunk(xi, yi, p, k, radius):
+    near, weights = idwWeights(_idwState['index'], xi, yi, p, k, radius)
+    vals = np.where(near >= 0, _idwState['v'][near], 0.)
+    vi   = np.sum(weights*vals, axis=1)
+    vi[~np.any(near >= 0, axis=1)] = np.nan
+    return vi
+
+#==============================================================================
+def idw(x, y, v, xi, yi, p=2, k=8, radius=None, geographic=False, 
+        chunkSize=100000, workers=1):
+    """
+    Computes inverse distance weighted interpolation from the nearby data 
+    points only, chunkSize grid points at a time, so neither 
+    memory nor time grow as len(x) x len(xi) (cf. shepardIDW).
+    Args:
+        x, y, v (float) : arrays for data coordinates and values
+        xi,  yi (float) : arrays for grid coordinates
+        p         (int) : scalar power (default=2)
+        k         (int) : number of nearest data points (default=8),
+                          None for all points within radius
+        radius  (float) : only use data points within radius 
+                          (meters if geographic)
+        geographic (bool) : coordinates are lon, lat; great circle distances
+        chunkSize (int) : number of grid points processed at once
+        workers   (int) : number of processes (None: os.cpu_count())
+    Returns:
+        vi      (float) : array of v interpolated onto xi and yi
+                          (NaN where there are no data points in radius)
+    """
+    if k is None and radius is None:
+        oper.sys.msg( 'e','Either k or radius is needed.')
+        return
+    v  = np.asarray(v, dtype=float)
+    xi = np.asarray(xi, dtype=float)
+    yi = np.asarray(yi, dtype=float)
+    chunks = [(xi[n0:n0+chunkSize], yi[n0:n0+chunkSize], p, k, radius) 
+              for n0 in range(0, len(xi), chunkSize)]
+    if workers == 1 or len(chunks) < 2:
+        _idwInit(x, y, v, geographic)
+        parts = [_idwChunk(*c) for c in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_idwInit,
+                                 initargs=(x, y, v, geographic)) as pool:
+            parts = list(pool.map(_idwChunk, *zip(*chunks)))
+    _idwState.clear()
+    return np.concatenate(parts) if parts else np.zeros(0)
+
+#==============================================================================
+class InterpOperator:
+    """
+    Precomputed interpolation from NS source points to NI target points,
+    stored as a sparse matrix in fixed-width form: every target row has
+    K source indices and weights (index -1 / weight 0 for padding).
+    Applying it to new values is one gather-multiply-sum:
+        op = InterpOperator.idw(x, y, xi, yi, k=8)
+        vi = op.apply(v)          # v [NS] or [NS, NF]
+        op.save(fileName)
+    InterpOperator.cached() keys the file on the source/target coordinates
+    and the parameters, so repeated runs skip the setup.
+    """
+    #--------------------------------------------------------------------------
+    def __init__ ( self, near, weights, nSource=None, key=None ):
+        """
+        Args:
+            near    (int   [NI, K]) : source indices (-1 for none)
+            weights (float [NI, K]) : weights
+            nSource (int)           : number of source points
+            key     (str)           : fingerprint of what the operator is for
+        """
+        self.near    = np.asarray(near, dtype=np.int64)
+        self.weights = np.asarray(weights, dtype=float)
+        self.nSource = int(nSource if nSource is not None else 
+                           self.near.max(initial=-1) + 1)
+        self.key     = key
+
+    @property
+    def shape ( self ):
+        return (len(self.near), self.nSource)
+
+    #--------------------------------------------------------------------------
+    def apply ( self, values, skipNaN=False ):
+        """
+        Interpolates values [NS] or [NS, NF] (several fields at once).
+        With skipNaN, NaN sources (e.g. dry nodes) are left out and the 
+        remaining weights renormalized; otherwise NaNs propagate.
+        Returns:
+            interpolated values [NI] or [NI, NF] (NaN for rows without sources)
+        """
+        values = np.asarray(values, dtype=float)
+        if len(values) != self.nSource:
+            raise ValueError('Expected ' + str(self.nSource) + 
+                             ' source values, got ' + str(len(values)))
+        valid = self.near >= 0
+        shape = self.weights.shape + (1,)*(values.ndim-1)
+        mask  = valid.reshape(shape)
+        vals  = np.where(mask, values[np.where(valid, self.near, 0)], 0.)
+        w     = np.where(mask, self.weights.reshape(shape), 0.)
+        if skipNaN:
+            nan  = np.isnan(vals)
+            w    = np.where(nan, 0., w)
+            vals = np.where(nan, 0., vals)
+            with np.errstate(invalid='ignore'):
+                out = np.sum(w*vals, axis=1) / np.sum(w, axis=1)
+        else:
+            out = np.sum(w*vals, axis=1)
+            out[~valid.any(axis=1)] = np.nan
+        return out
+
+    #--------------------------------------------------------------------------
+    def save ( self, fileName ):
+        """
+        Writes the operator to fileName (.npz), atomically
+        """
+        tmpFile = fileName + '.tmp' + str(os.getpid()) + '.npz'
+        np.savez(tmpFile, near=self.near, weights=self.weights,
+                 nSource=self.nSource, key=str(self.key))
+        os.replace(tmpFile, fileName)
+        return fileName
+
+    @classmethod
+    def load ( cls, fileName ):
+        with np.load(fileName) as f:
+            key = str(f['key'])
+            return cls(f['near'], f['weights'], int(f['nSource']), 
+                       None if key == 'None' else key)
+
+    #--------------------------------------------------------------------------
+    @staticmethod
+    def fingerprint ( *arrays, **params ):
+        """
+        SHA-1 of the coordinate arrays and parameters
+        """
+        h = hashlib.sha1()
+        for a in arrays:
+            a = np.ascontiguousarray(a, dtype=float)
+            h.update(str(a.shape).encode())
+            h.update(a.tobytes())
+        h.update(repr(sorted(params.items())).encode())
+        return h.hexdigest()
+
+    @classmethod
+    def idw ( cls, x, y, xi, yi, p=2, k=8, radius=None, geographic=False,
+              chunkSize=100000 ):
+        """
+        IDW operator, see idw() for the arguments
+        """
+        index = spatial.PointIndex(x, y, geographic=geographic)
+        near, weights = [], []
+        for n0 in range(0, len(xi), chunkSize):
+            n, w = idwWeights(index, xi[n0:n0+chunkSize], 
+                              yi[n0:n0+chunkSize], p, k, radius)
+            near.append(n)
+            weights.append(w)
+        width = max([n.shape[1] for n in near] + [1])
+        pad   = lambda a, v: np.pad(a, ((0, 0), (0, width - a.shape[1])),
+                                    constant_values=v)
+        near    = np.vstack([pad(n, -1) for n in near] + 
+                            [np.zeros((0, width), dtype=np.int64)])
+        weights = np.vstack([pad(w, 0.) for w in weights] + 
+                            [np.zeros((0, width))])
+        key = cls.fingerprint(x, y, xi, yi, method='idw', p=p, k=k, 
+                              radius=radius, geographic=geographic)
+        return cls(near, weights, len(x), key)
+
+    @classmethod
+    def cached ( cls, cacheDir, x, y, xi, yi, verbose=1, **kwargs ):
+        """
+        Loads the IDW operator for these coordinates and parameters from 
+        cacheDir, or builds and saves it there.
+        """
+        key = cls.fingerprint(x, y, xi, yi, method='idw', **dict(
+                  {'p' : 2, 'k' : 8, 'radius' : None, 'geographic' : False},
+                  **{a : kwargs[a] for a in kwargs if a != 'chunkSize'}))
+        fileName = os.path.join(cacheDir, 'interp.' + key[:16] + '.npz')
+        if os.path.exists(fileName):
+            try:
+                op = cls.load(fileName)
+                if op.key == key:
+                    if verbose:
+                        oper.sys.msg( 'i','Interpolation operator loaded from ' + 
+                                      fileName)
+                    return op
+            except (OSError, ValueError, KeyError) as e:
+                oper.sys.msg( 'w','Cannot read ' + fileName + ': ' + str(e))
+        op = cls.idw(x, y, xi, yi, **kwargs)
+        try:
+            os.makedirs(cacheDir, exist_ok=True)
+            op.save(fileName)
+            if verbose:
+                oper.sys.msg( 'i','Interpolation operator saved to ' + fileName)
+        except OSError as e:
+            oper.sys.msg( 'w','Cannot write ' + fileName + ': ' + str(e))
+        return op
+
 #==============================================================================
 def taperLinear (z_full, z_zero, zg, vg):
     """
@@ -78,10 +324,7 @@ def taperLinear (z_full, z_zero, zg, vg):
     """
     oper.sys.msg( 'i','Computing linear taper...')
     
-    #TODO: Optimize
-    for n in range(len(vg)):
-        w = (zg[n]-z_zero)/(z_full-z_zero)
-        vg[n] = w*vg[n]
+    vg[:] = (np.asarray(zg)-z_zero)/(z_full-z_zero)*np.asarray(vg)
     return vg
 
 #==============================================================================
@@ -98,15 +341,37 @@ def taperExp (z_full, z_zero, zg, vg):
     """
     oper.sys.msg( 'i','Computing exponential taper...')
     
-    #TODO: Optimize
-    for n in range(len(vg)):
-        #w = (zg[n]-z_zero)/(z_full-z_zero)
-        if zg[n]>z_full:
-            w     = z_zero/(z_zero-z_full)*(z_full/zg[n]-1.0) + 1.0
-            vg[n] = w*vg[n]
+    if not isinstance(vg, np.ndarray):
+        vg = np.array(vg, dtype=float)
+    zg   = np.asarray(zg)
+    deep = zg > z_full
+    w    = z_zero/(z_zero-z_full)*(z_full/zg[deep]-1.0) + 1.0
+    vg[deep] = w*vg[deep]
     return vg
 
 
+#==============================================================================
+def _alignNearest (dates, vals, refDates, prec):
+    """
+    Picks vals at the dates nearest to each of refDates, as nearest() does
+    (earlier date on ties, first of duplicate dates), using binary search
+    on the sorted dates. Returns NaN where the nearest date is prec 
+    or more away.
+    """
+    out = np.full(len(refDates), np.nan)
+    if not len(dates):
+        return out
+    i   = np.searchsorted(dates, refDates)
+    lo  = np.clip(i-1, 0, len(dates)-1)
+    hi  = np.clip(i,   0, len(dates)-1)
+    dlo = np.abs(refDates - dates[lo])
+    dhi = np.abs(dates[hi] - refDates)
+    idx = np.where(dhi < dlo, hi, lo)
+    idx = np.searchsorted(dates, dates[idx])  # first of duplicates
+    ok  = np.minimum(dlo, dhi) < prec
+    out[ok] = vals[idx[ok]]
+    return out
+
 #============================================================================== 
 def retime (obsDates, obsVals, modDates, modVals, refStepMinutes=6):
     """
@@ -114,6 +379,9 @@ def retime (obsDates, obsVals, modDates, modVals, refStepMinutes=6):
     onto a common reference time scale with a resolution defined by
     refStepMinutes. 
     Note: tolerance for dates projection is half of refStepMinutes.
+    Of duplicate dates, the value that comes first in the input is used.
+    Dates can be datetime or np.datetime64; refDates are returned as 
+    np.datetime64 if obsDates are.
     Args:
         obsDates (datetime np.array of length Lobs ) : dates  for timeseries 1
         obsVals  (np.array of length Lobs)           : values for timeseries 1
@@ -125,14 +393,12 @@ def retime (obsDates, obsVals, modDates, modVals, refStepMinutes=6):
         obsValsProj (np.array)           : projected values of timeseries 1
         modValsProj (np.array)           : projected values of timeseries 2
     """
-    refDates    = []
-    obsValsProj = []
-    modValsProj = []
+    asDatetime64 = np.issubdtype(np.asarray(obsDates).dtype, np.datetime64)
 
     #Sort by date
-    obsDates  = np.array(obsDates)
+    obsDates  = np.array(obsDates, dtype='datetime64[us]')
     obsVals   = np.array(obsVals)
-    ind       = np.argsort(obsDates)
+    ind       = np.argsort(obsDates, kind='stable')
     obsDates  = obsDates[ind]
     obsVals   = obsVals[ind]
     # Remove nans
@@ -142,9 +408,9 @@ def retime (obsDates, obsVals, modDates, modVals, refStepMinutes=6):
         
     #Sort by date
     #modVals   = np.ma.filled(modValsMasked, np.nan)
-    modDates  = np.array(modDates)
+    modDates  = np.array(modDates, dtype='datetime64[us]')
     modVals   = np.array(modVals)
-    ind       = np.argsort(modDates)
+    ind       = np.argsort(modDates, kind='stable')
     modDates  = modDates[ind]
     modVals   = modVals[ind]
     # Remove nans
@@ -159,30 +425,132 @@ def retime (obsDates, obsVals, modDates, modVals, refStepMinutes=6):
     # Create reference time line
     refStart = np.maximum(np.min(obsDates), np.min(modDates))
     refEnd   = np.minimum(np.max(obsDates), np.max(modDates))
-    refStep  = timedelta(minutes=refStepMinutes)
-    prec     = timedelta(minutes=0.5*refStepMinutes)
+    refStep  = np.timedelta64(int(round(60e6*refStepMinutes)), 'us')
+    prec     = np.timedelta64(int(round(30e6*refStepMinutes)), 'us')
    
-    refDates = np.arange(refStart, refEnd, refStep).astype(datetime.datetime)
+    refDates = np.arange(refStart, refEnd, refStep)
 
     # Project obs and model onto reference time line
-    obsValsProj  = []    
-    modValsProj  = []
-
-    for t in refDates:
-        #find t in obsDates within refStep
-        nearestObsDate, idx = nearest(obsDates, t)
-        if abs(nearestObsDate - t) < prec:
-            nearestObsVal   = obsVals[idx]
-            obsValsProj.append (nearestObsVal)
-        else:
-            obsValsProj.append (np.nan)
+    obsValsProj = _alignNearest(obsDates, obsVals, refDates, prec)
+    modValsProj = _alignNearest(modDates, modVals, refDates, prec)
 
-        nearestModDate, idx = nearest(modDates, t)
-        if abs(nearestModDate - t) < prec:
-            nearestModVal   = modVals[idx]
-            modValsProj.append (nearestModVal)
-        else:
-            modValsProj.append (np.nan)
+    if not asDatetime64:
+        refDates = refDates.astype(datetime.datetime)
+    return refDates, obsValsProj, modValsProj
 
-    return refDates, np.array(obsValsProj), np.array(modValsProj)
+#==============================================================================
+def _alignRagged (station, t, v, ns, ref, method, prec, maxGap):
+    """
+    Aligns ns series given as flat samples (station, t, v), t in integer
+    microseconds, onto ref [NR] for all stations at once: the series are 
+    laid end to end on one sorted axis, station*span + t, so that one
+    binary search finds the neighbors of every (station, ref) pair.
+    Returns [NR, ns].
+    """
+    out = np.full((ns, len(ref)), np.nan)
+    if not len(t) or not len(ref):
+        return out.T
+    base  = min(t.min(), ref.min())
+    span  = max(t.max(), ref.max()) - base + 2*max(prec, 0) + 1
+    key   = (t - base) + station*span
+    order = np.argsort(key, kind='stable')
+    key, v, station = key[order], v[order], station[order]
+    q     = (ref - base)[None, :] + (np.arange(ns)*span)[:, None]
+    own   = np.arange(ns)[:, None]
+    last  = len(key) - 1
+
+    if method == 'nearest':
+        i   = np.searchsorted(key, q)
+        lo  = np.clip(i-1, 0, last)
+        hi  = np.clip(i,   0, last)
+        okL = (i > 0)    & (station[lo] == own)
+        okH = (i <= last) & (station[hi] == own)
+        dlo = np.where(okL, q - key[lo], np.iinfo(np.int64).max)
+        dhi = np.where(okH, key[hi] - q, np.iinfo(np.int64).max)
+        idx = np.where(dhi < dlo, hi, lo)
+        idx = np.searchsorted(key, key[idx])  # first of duplicates
+        ok  = np.minimum(dlo, dhi) < prec
+        out[ok] = v[idx[ok]]
+    else:
+        i   = np.searchsorted(key, q, side='right')
+        lo  = np.clip(i-1, 0, last)
+        hi  = np.clip(i,   0, last)
+        okL = (i > 0)    & (station[lo] == own)
+        okH = (i <= last) & (station[hi] == own)
+        hit = okL & (key[lo] == q)
+        gap = key[hi] - key[lo]
+        ok  = okL & okH & ~hit
+        if maxGap is not None:
+            ok &= gap <= maxGap
+        w = np.where(ok, (q - key[lo]) / np.where(gap > 0, gap, 1), 0.)
+        out[ok]  = v[lo][ok] + w[ok]*(v[hi][ok] - v[lo][ok])
+        out[hit] = v[lo][hit]
+    return out.T
+
+#==============================================================================
+def retimeBatch (obsDates, obsVals, modDates, modVals, refStepMinutes=6,
+                 refDates=None, method='nearest', maxGapMinutes=None):
+    """
+    Projects many stations at once onto a common reference time scale.
+    Args:
+        obsDates (list of NS date arrays)    : observation dates per station
+        obsVals  (list of NS arrays)         : observation values per station
+                                               (ragged, NaN are dropped)
+        modDates (date array [NT])           : model dates
+        modVals  (np.array [NT, NS])         : model values 
+                                               (e.g. readTimeSeries 'zeta')
+        refStepMinutes (int, default=6)      : projection time step
+        refDates (date array, optional)      : reference dates; default is
+                                               every refStepMinutes over 
+                                               the overlap of model and obs
+        method (str) : 'nearest' - as retime, nearest date within half 
+                                   of refStepMinutes
+                       'linear'  - linear interpolation in time between 
+                                   the samples around each reference date
+        maxGapMinutes (float) : 'linear' does not bridge gaps longer
+                                than this (default: no limit)
+    Returns:
+        refDates (np.datetime64 array [NR])  : projection dates
+        obsProj  (np.array [NR, NS])         : projected observations
+        modProj  (np.array [NR, NS])         : projected model values
+    """
+    if method not in ('nearest', 'linear'):
+        oper.sys.msg( 'e','Unknown method ' + str(method) + '.')
+        return
+    usec     = lambda d: np.asarray(d, dtype='datetime64[us]').astype(np.int64)
+    modVals  = np.ma.filled(np.ma.asarray(modVals, dtype=float), np.nan)
+    modVals  = modVals.reshape(len(modVals), -1)
+    ns       = modVals.shape[1]
+    if len(obsDates) != ns or len(obsVals) != ns:
+        oper.sys.msg( 'e','Expected ' + str(ns) + ' observation series.')
+        return
+
+    # flat (station, time, value) samples without NaNs
+    lengths = [len(d) for d in obsDates]
+    obsSt   = np.repeat(np.arange(ns), lengths)
+    obsT    = np.concatenate([usec(d) for d in obsDates] + 
+                             [np.zeros(0, dtype=np.int64)])
+    obsV    = np.concatenate([np.ma.filled(np.ma.asarray(v, dtype=float), 
+                                           np.nan) for v in obsVals] + 
+                             [np.zeros(0)])
+    ok      = ~np.isnan(obsV)
+    obsSt, obsT, obsV = obsSt[ok], obsT[ok], obsV[ok]
+    modT, modSt = np.nonzero(~np.isnan(modVals))
+    modV    = modVals[modT, modSt]
+    modT    = usec(modDates)[modT]
+
+    step = int(round(60e6*refStepMinutes))
+    prec = int(round(30e6*refStepMinutes))
+    if refDates is None:
+        if not len(obsT) or not len(modT):
+            refDates = np.zeros(0, dtype=np.int64)
+        else:
+            refDates = np.arange(max(obsT.min(), modT.min()), 
+                                 min(obsT.max(), modT.max()), step)
+    else:
+        refDates = usec(refDates)
+    maxGap = None if maxGapMinutes is None else int(round(60e6*maxGapMinutes))
 
+    obsProj = _alignRagged(obsSt, obsT, obsV, ns, refDates, method, prec, maxGap)
+    modProj = _alignRagged(modSt, modT, modV, ns, refDates, method, prec, maxGap)
+    return refDates.astype('datetime64[us]'), obsProj, modProj
@@ -0,0 +1,608 @@
+"""
+@author: Sergey.Vinogradov@noaa.gov
+"""
+
+import numpy as np
+
+EARTH_RADIUS = 6371009.0  # mean Earth radius, meters
+
+#==============================================================================
+def toSphere (lon, lat):
+    """
+    Converts lon, lat (degrees) to unit vectors on the sphere [N, 3]
+    """
+    lon = np.radians(np.asarray(lon, dtype=float))
+    lat = np.radians(np.asarray(lat, dtype=float))
+    return np.column_stack((np.cos(lat)*np.cos(lon),
+                            np.cos(lat)*np.sin(lon),
+                            np.sin(lat)))
+
+#==============================================================================
+def chordToMeters (chord):
+    """
+    Converts the chord between two unit vectors to great circle distance
+    """
+    return 2.0*EARTH_RADIUS*np.arcsin(np.minimum(0.5*chord, 1.0))
+
+#==============================================================================
+def metersToChord (meters):
+    """
+    Converts great circle distance to the chord between two unit vectors
+    """
+    return 2.0*np.sin(np.minimum(0.5*np.asarray(meters)/EARTH_RADIUS, 0.5*np.pi))
+
+#==============================================================================
+def _localBasis (xyz):
+    """
+    Orthonormal basis with the third axis along the mean direction of
+    the unit vectors xyz: a regional mesh then lies in a thin slab,
+    and its projection on the first two axes can be binned instead.
+    """
+    m = np.sum(xyz, axis=0)
+    if not np.any(m):
+        return np.eye(3)
+    m = m/np.linalg.norm(m)
+    a = np.eye(3)[np.argmin(np.abs(m))]
+    e1 = np.cross(m, a)
+    e1 = e1/np.linalg.norm(e1)
+    return np.vstack((e1, np.cross(m, e1), m))
+
+#==============================================================================
+def _expand (starts, counts):
+    """
+    Concatenates ranges [starts[i], starts[i]+counts[i]) without a loop
+    """
+    total = int(np.sum(counts))
+    if total == 0:
+        return np.zeros(0, dtype=np.int64)
+    shift = np.repeat(starts - np.cumsum(counts) + counts, counts)
+    return shift + np.arange(total)
+
+#==============================================================================
+_SPREAD = {2 : [(16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF),
+                (4,  0x0F0F0F0F0F0F0F0F), (2, 0x3333333333333333),
+                (1,  0x5555555555555555)],
+           3 : [(32, 0x001F00000000FFFF), (16, 0x001F0000FF0000FF),
+                (8,  0x100F00F00F00F00F), (4,  0x10C30C30C30C30C3),
+                (2,  0x1249249249249249)]}
+
+def _interleave (cells):
+    """
+    Morton (Z-order) codes of bins [N, 2 or 3]: bits of their integer
+    coordinates interleaved, so that the bins of every coarser level
+    are contiguous ranges of codes
+    """
+    ndim = cells.shape[1]
+    code = np.zeros(len(cells), dtype=np.uint64)
+    for n in range(ndim):
+        c = cells[:, n].astype(np.uint64)
+        for shift, mask in _SPREAD[ndim]:
+            c = (c | (c << np.uint64(shift))) & np.uint64(mask)
+        code |= c << np.uint64(n)
+    return code
+
+#==============================================================================
+def _kSmallest (qid, dist, idx, nq, k, maxCells=4000000):
+    """
+    For candidates (qid, dist, idx), grouped by ascending qid, keeps 
+    k smallest dist per query. Candidates of queries with about as many
+    of them are laid out in padded [queries, max count] tables of about
+    maxCells and partitioned row-wise, which is much cheaper than sorting
+    all candidates.
+    Returns dist and idx [nq, k], padded with inf and -1.
+    """
+    counts = np.bincount(qid, minlength=nq)
+    first  = np.cumsum(counts) - counts
+    rank   = np.arange(len(qid)) - first[qid]
+    outD   = np.full([nq, k], np.inf)
+    outI   = np.full([nq, k], -1, dtype=np.int64)
+    byCount = np.argsort(counts, kind='stable')
+    sizes   = counts[byCount]
+    a = int(np.searchsorted(sizes, 1))
+    while a < nq:
+        rows = np.arange(1, nq - a + 1)*np.maximum(sizes[a:], k)
+        b    = a + max(1, int(np.searchsorted(rows, maxCells, side='right')))
+        M    = max(int(sizes[b-1]), k)
+        sub  = byCount[a:b]
+        pos  = _expand(first[sub], counts[sub])
+        row  = np.repeat(np.arange(b-a), counts[sub])
+        D = np.full([b-a, M], np.inf)
+        I = np.full([b-a, M], -1, dtype=np.int64)
+        D[row, rank[pos]] = dist[pos]
+        I[row, rank[pos]] = idx[pos]
+        if M > k:
+            part = np.argpartition(D, k-1, axis=1)[:, :k]
+            D = np.take_along_axis(D, part, axis=1)
+            I = np.take_along_axis(I, part, axis=1)
+        srt = np.argsort(D, axis=1)
+        outD[sub] = np.take_along_axis(D, srt, axis=1)
+        outI[sub] = np.take_along_axis(I, srt, axis=1)
+        a = b
+    return outD, outI
+
+#==============================================================================
+def _subset (cells, keep):
+    """
+    Bins (see PointIndex._blockCells) of the queries kept, renumbered
+    """
+    owner = cells[0]
+    sel   = keep[owner]
+    renum = np.cumsum(keep) - 1
+    return (renum[owner[sel]],) + tuple(a[sel] for a in cells[1:])
+
+#==============================================================================
+def _closest (cells, k, nq):
+    """
+    Nearest bins (see PointIndex._blockCells) of each query that hold
+    k points between them. Returns these bins, and the distance to the 
+    nearest of the others (inf if none).
+    """
+    owner, gap, p0, p1 = cells
+    order  = np.lexsort((gap, owner))
+    owner, gap, p0, p1 = owner[order], gap[order], p0[order], p1[order]
+    counts = p1 - p0
+    total  = np.cumsum(counts)
+    first  = np.r_[True, owner[1:] != owner[:-1]]
+    base   = np.maximum.accumulate(np.where(first, total - counts, 0))
+    before = total - counts - base
+    keep   = before < k
+    beyond = np.full(nq, np.inf)
+    # the first bin left out of each query: the last one of a run of
+    # kept bins is followed by it
+    out = np.flatnonzero(~keep & np.r_[True, keep[:-1]])
+    beyond[owner[out]] = gap[out]
+    return owner[keep], gap[keep], p0[keep], p1[keep], beyond
+
+#==============================================================================
+class PointIndex:
+    """
+    Multi-level bin grid over scattered points (e.g. grid nodes) for batched
+    k-nearest and radius queries. Points are sorted by the Morton (Z-order)
+    code of their finest bins, so that every bin of every coarser level
+    (2, 4, 8... times wider) is a contiguous range of them: only the sorted
+    codes are stored, and each query is answered at the level that suits
+    the density of points around it, which keeps graded meshes (refined
+    coasts next to a sparse ocean) as fast as uniform ones.
+    With geographic=True the points are lon/lat in degrees, binned as
+    unit vectors on the sphere (no trouble at the dateline or poles),
+    rotated to the mean direction of the points, and distances are
+    great circle distances in meters.
+    """
+    #--------------------------------------------------------------------------
+    def __init__ (self, x, y, geographic=False):
+        """
+        Args:
+            x, y (float)      : point coordinates (lon, lat if geographic)
+            geographic (bool) : use great circle distances
+        """
+        self.geographic = geographic
+        self.basis      = np.eye(3)
+        if geographic:
+            self.basis  = _localBasis(toSphere(x, y))
+        self.coords     = self._coords(x, y)
+        npts, ndim      = self.coords.shape
+        self.lo = self.coords.min(axis=0) if npts else np.zeros(ndim)
+        extent  = self.coords.max(axis=0) - self.lo if npts else np.zeros(ndim)
+        # a regional mesh lies in a thin slab: bin its projection, which 
+        # can only add candidates, not lose them
+        if ndim == 3 and extent[2] <= np.sort(extent)[1]/8.:
+            ndim = 2
+        self.ndim   = ndim
+        # finest bins h wide, 2^levels of them across: codes fit in 64 bits
+        self.levels = 62 // ndim
+        span   = np.max(extent[:ndim])
+        self.h = span/(2**self.levels - 1) if span > 0 else 1.
+
+        codes = _interleave(self._cells(self.coords))
+        self.order = np.argsort(codes, kind='stable')
+        self.codes = codes[self.order]
+
+    #--------------------------------------------------------------------------
+    def __len__ (self):
+        return len(self.coords)
+
+    def _coords (self, x, y):
+        if self.geographic:
+            return toSphere(x, y) @ self.basis.T
+        return np.column_stack((np.asarray(x, dtype=float).ravel(),
+                                np.asarray(y, dtype=float).ravel()))
+
+    def _cells (self, coords):
+        """
+        Finest bins of coords, clipped to the extent of the points
+        """
+        c = np.floor((coords[:, :self.ndim] - self.lo[:self.ndim])/self.h)
+        return np.clip(c, 0, 2**self.levels - 1).astype(np.int64)
+
+    def _distance (self, chord):
+        return chordToMeters(chord) if self.geographic else chord
+
+    #--------------------------------------------------------------------------
+    def _ranges (self, cells, level):
+        """
+        Ranges [p0, p1) of the sorted points in bins of the given levels
+        """
+        shift = (self.ndim*level).astype(np.uint64)
+        code  = _interleave(cells)
+        p0 = np.searchsorted(self.codes, code << shift)
+        p1 = np.searchsorted(self.codes, (code + np.uint64(1)) << shift)
+        return p0, p1
+
+    #--------------------------------------------------------------------------
+    def _level (self, qcells, k):
+        """
+        Finest level at which the bins of the queries hold k points
+        (binary search: the bins of a query are nested)
+        """
+        lo = np.zeros(len(qcells), dtype=np.int64)
+        hi = np.full(len(qcells), self.levels, dtype=np.int64)
+        act = np.arange(len(qcells))
+        while len(act):
+            mid = (lo[act] + hi[act]) // 2
+            p0, p1 = self._ranges(qcells[act] >> mid[:, None], mid)
+            ok = p1 - p0 >= k
+            hi[act[ok]]  = mid[ok]
+            lo[act[~ok]] = mid[~ok] + 1
+            act = act[lo[act] < hi[act]]
+        return lo
+
+    #--------------------------------------------------------------------------
+    def _radiusLevel (self, radius, cells=2):
+        """
+        Level at which radius spans about the given number of bins
+        """
+        with np.errstate(divide='ignore'):
+            level = np.ceil(np.log2(np.maximum(radius, 0)/(cells*self.h)))
+        return np.clip(level, 0, self.levels).astype(np.int64)
+
+    #--------------------------------------------------------------------------
+    def _ball (self, q, radius, level):
+        """
+        Blocks of bins of the given levels that hold the balls of radius
+        around the queries. Returns the first and the last bins.
+        """
+        d    = self.ndim
+        size = self.h*2.0**level[:, None]
+        top  = (2**self.levels - 1) >> level[:, None]
+        r    = np.maximum(radius, 0)[:, None]
+        x    = q[:, :d] - self.lo[:d]
+        lo   = np.clip(np.floor((x - r)/size), 0, top).astype(np.int64)
+        hi   = np.clip(np.floor((x + r)/size), 0, top).astype(np.int64)
+        return lo, hi
+
+    #--------------------------------------------------------------------------
+    def _margin (self, q, lo, hi, level):
+        """
+        Distance from the queries to the nearest side of their blocks
+        of bins that has bins beyond it (inf if none)
+        """
+        d    = self.ndim
+        size = self.h*2.0**level[:, None]
+        top  = (2**self.levels - 1) >> level[:, None]
+        x    = q[:, :d] - self.lo[:d]
+        below = np.where(lo > 0, x - lo*size, np.inf)
+        above = np.where(hi < top, (hi + 1)*size - x, np.inf)
+        return np.minimum(below.min(axis=1), above.min(axis=1))
+
+    #--------------------------------------------------------------------------
+    def _around (self, q, qcells, level, shift=0):
+        """
+        Blocks of 2^d bins of the given levels around the queries: their
+        bins and the neighbors on the side of the queries, as blocks of 
+        the bins 2^shift times narrower. Returns the first and the last
+        bins.
+        """
+        d     = self.ndim
+        top   = (2**self.levels - 1) >> level[:, None]
+        c     = qcells >> level[:, None]
+        size  = self.h*2.0**level[:, None]
+        side  = (q[:, :d] - self.lo[:d])/size - c < 0.5
+        lo    = np.clip(c - side, 0, np.maximum(top - 1, 0))
+        hi    = np.minimum(lo + 1, top)
+        shift = np.reshape(shift, (-1, 1))
+        return lo << shift, ((hi + 1) << shift) - 1
+
+    #--------------------------------------------------------------------------
+    def _blockCells (self, q, lo, hi, level, radius=None):
+        """
+        Occupied bins in the blocks [lo, hi] of bins of the given levels,
+        one block per query, without the bins farther than radius from
+        the query. Returns query numbers (ascending), distances from the
+        queries to the bins, and the ranges [p0, p1) of the sorted points
+        in the bins.
+        """
+        d       = self.ndim
+        lengths = hi - lo + 1
+        totals  = np.prod(lengths, axis=1)
+        owner   = np.repeat(np.arange(len(q)), totals)
+        flat    = _expand(np.zeros(len(q), dtype=np.int64), totals)
+        cells   = np.zeros([len(flat), d], dtype=np.int64)
+        for n in range(d):
+            L = np.repeat(lengths[:, n], totals)
+            cells[:, n] = np.repeat(lo[:, n], totals) + flat % L
+            flat = flat // L
+        lv     = level[owner]
+        p0, p1 = self._ranges(cells, lv)
+        full   = np.flatnonzero(p1 > p0)
+        owner, cells, lv, p0, p1 = owner[full], cells[full], lv[full], \
+                                   p0[full], p1[full]
+        size = self.h*2.0**lv[:, None]
+        x    = q[owner, :d] - self.lo[:d]
+        gap  = np.maximum(np.maximum(cells*size - x, x - (cells + 1)*size), 0)
+        gap  = np.sqrt(np.sum(gap**2, axis=1))
+        if radius is None:
+            return owner, gap, p0, p1
+        near = gap <= radius[owner]
+        return owner[near], gap[near], p0[near], p1[near]
+
+    #--------------------------------------------------------------------------
+    def _gather (self, q, cells, maxPairs=4000000):
+        """
+        Candidate points in the bins of the queries (see _blockCells), 
+        about maxPairs at a time. Yields slices of the queries, and query
+        numbers (within the slice, ascending), distances and point indices
+        of their candidates.
+        """
+        owner, _, p0, p1 = cells
+        counts = p1 - p0
+        cost   = np.cumsum(np.bincount(owner, weights=counts, minlength=len(q)))
+        first  = np.searchsorted(owner, np.arange(len(q) + 1))
+        n0 = 0
+        while n0 < len(q):
+            done = cost[n0-1] if n0 else 0.
+            n1 = max(n0+1, int(np.searchsorted(cost, done + maxPairs, side='right')))
+            n1 = min(n1, len(q))
+            c0, c1 = first[n0], first[n1]
+            idx  = self.order[_expand(p0[c0:c1], counts[c0:c1])]
+            qid  = np.repeat(owner[c0:c1], counts[c0:c1])
+            dist = np.sqrt(np.sum((self.coords[idx] - q[qid])**2, axis=1))
+            yield slice(n0, n1), qid - n0, dist, idx
+            n0 = n1
+
+    #--------------------------------------------------------------------------
+    def _kNearest (self, q, ids, cells, k, outD, outI):
+        """
+        k nearest candidates of queries ids in their bins
+        """
+        for sub, qid, dist, idx in self._gather(q[ids], cells):
+            d, i = _kSmallest(qid, dist, idx, sub.stop - sub.start, k)
+            outD[ids[sub], :k], outI[ids[sub], :k] = d, i
+
+    #--------------------------------------------------------------------------
+    def nearest (self, xq, yq, k=1):
+        """
+        Finds k nearest points to each of the query points.
+        Args:
+            xq, yq (float) : query coordinates (lon, lat if geographic)
+            k        (int) : number of neighbors
+        Returns:
+            dist  (float [NQ, k]) : distances, ascending (meters if geographic)
+            index (int   [NQ, k]) : point indices (-1 if fewer than k points)
+            Both are 1D [NQ] when k == 1.
+        """
+        q  = self._coords(xq, yq)
+        nq = len(q)
+        kk = min(k, len(self.coords))
+        outD = np.full([nq, k], np.inf)
+        outI = np.full([nq, k], -1, dtype=np.int64)
+        if nq and kk:
+            d      = self.ndim
+            ids    = np.arange(nq)
+            qcells = self._cells(q)
+            # queries in the order of the points: neighbors share bins
+            perm   = np.argsort(_interleave(qcells), kind='stable')
+            q, qcells = q[perm], qcells[perm]
+            level  = self._level(qcells, kk)
+            half   = np.maximum(level - 1, 0)
+            top    = (2**self.levels - 1) >> half[:, None]
+            c      = qcells >> half[:, None]
+            lo, hi = np.maximum(c - 1, 0), np.minimum(c + 1, top)
+            cells  = self._blockCells(q, lo, hi, half)
+            pairs  = np.bincount(cells[0], weights=cells[3] - cells[2],
+                                 minlength=nq)
+            # the 3^d bins around a query, half as wide as its finest bin
+            # that holds k points: if they hold a few, the k nearest of them
+            # are exact when the k-th is closer than the sides of the block
+            few   = (pairs >= kk) & (pairs <= 2**d*8*(kk + 4))
+            self._kNearest(q, ids[few], _subset(cells, few), kk, outD, outI)
+            exact = few & (outD[:, kk-1] <= self._margin(q, lo, hi, half))
+            # many (next to a refined zone): the nearest of the narrower
+            # bins around the query that hold k points between them
+            many = ids[~few]
+            if len(many):
+                shift = 4 - d
+                fine  = np.maximum(level[many] - shift, 0)
+                lo, hi = self._around(q[many], qcells[many], level[many],
+                                      level[many] - fine)
+                cells  = _closest(self._blockCells(q[many], lo, hi, fine), kk,
+                                  len(many))
+                self._kNearest(q, many, cells[:4], kk, outD, outI)
+                exact[many] = (outD[many, kk-1] <= cells[4]) & \
+                    (outD[many, kk-1] <= self._margin(q[many], lo, hi, fine))
+            # otherwise all the points within the k-th distance found
+            rest = ids[~exact]
+            if len(rest):
+                radius = outD[rest, kk-1]
+                level  = self._radiusLevel(radius, cells=4 if d == 2 else 2)
+                lo, hi = self._ball(q[rest], radius, level)
+                cells  = self._blockCells(q[rest], lo, hi, level, radius)
+                self._kNearest(q, rest, cells, kk, outD, outI)
+            outD[perm], outI[perm] = outD.copy(), outI.copy()
+        outD = np.where(outI < 0, np.inf, self._distance(outD))
+        if k == 1:
+            return outD[:, 0], outI[:, 0]
+        return outD, outI
+
+    #--------------------------------------------------------------------------
+    def within (self, xq, yq, radius):
+        """
+        Finds all points within radius of each of the query points.
+        Args:
+            xq, yq (float) : query coordinates (lon, lat if geographic)
+            radius (float) : search radius (meters if geographic), 
+                             scalar or one per query
+        Returns:
+            qid, dist, index : query numbers (ascending), distances and 
+                               point indices of the pairs found
+        """
+        q      = self._coords(xq, yq)
+        nq     = len(q)
+        empty  = (np.zeros(0, dtype=np.int64), np.zeros(0), 
+                  np.zeros(0, dtype=np.int64))
+        if not nq or not len(self.coords):
+            return empty
+        rq = np.broadcast_to(np.asarray(radius, dtype=float), (nq,))
+        if self.geographic:
+            rq = metersToChord(rq)
+        level  = self._radiusLevel(rq, cells=4 if self.ndim == 2 else 2)
+        lo, hi = self._ball(q, rq, level)
+        cells  = self._blockCells(q, lo, hi, level, rq)
+        parts  = []
+        for sub, qid, dist, idx in self._gather(q, cells):
+            keep = dist <= rq[sub][qid]
+            parts.append((qid[keep] + sub.start, dist[keep], idx[keep]))
+        qid, dist, idx = [np.concatenate(a) for a in zip(*parts)]
+        return qid, self._distance(dist), idx
+
+#==============================================================================
+def barycentric (x, y, xt, yt):
+    """
+    Barycentric weights of points (x, y) in triangles xt, yt [N, 3].
+    Returns weights [N, 3] (NaN for degenerate triangles).
+    """
+    det = (yt[:,1]-yt[:,2])*(xt[:,0]-xt[:,2]) + (xt[:,2]-xt[:,1])*(yt[:,0]-yt[:,2])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        w0 = ((yt[:,1]-yt[:,2])*(x-xt[:,2]) + (xt[:,2]-xt[:,1])*(y-yt[:,2]))/det
+        w1 = ((yt[:,2]-yt[:,0])*(x-xt[:,2]) + (xt[:,0]-xt[:,2])*(y-yt[:,2]))/det
+    return np.column_stack((w0, w1, 1.0 - w0 - w1))
+
+#==============================================================================
+class ElementIndex:
+    """
+    Locates the elements containing query points, and their barycentric
+    weights, in the lon/lat plane. Candidates are the elements around the
+    k nearest nodes of each query point, all tested at once; points that
+    none of them contains (e.g. inside a large element next to a refined
+    zone) are tested against all elements whose bounding box holds them.
+    Built from a csdllib.models.grid.Grid (uses its nodeElements).
+    """
+    #--------------------------------------------------------------------------
+    def __init__ (self, grid, pointIndex=None):
+        """
+        Args:
+            grid (Grid)             : mesh topology
+            pointIndex (PointIndex) : planar index of the grid nodes
+        """
+        self.lon      = np.asarray(grid.lon, dtype=float)
+        self.lat      = np.asarray(grid.lat, dtype=float)
+        self.elements = grid.elements
+        self.nodeElements = grid.nodeElements
+        if pointIndex is None:
+            pointIndex = PointIndex(self.lon, self.lat)
+        self.pointIndex = pointIndex
+        self._boxes = None
+
+    #--------------------------------------------------------------------------
+    def _test (self, xq, yq, qid, elems, eps, outE, outN, outW):
+        """
+        Tests candidate elems of queries qid and stores the most interior
+        containing element of every query
+        """
+        tri = self.elements[elems]
+        w   = barycentric(xq[qid], yq[qid], self.lon[tri], self.lat[tri])
+        score = np.min(w, axis=1)
+        hit   = score >= -eps
+        qid, elems, w, score = qid[hit], elems[hit], w[hit], score[hit]
+        if not len(qid):
+            return
+        # the most interior candidate wins on shared edges and vertices
+        order = np.lexsort((-score, qid))
+        qid, elems, w = qid[order], elems[order], w[order]
+        first = np.r_[True, qid[1:] != qid[:-1]]
+        outE[qid[first]] = elems[first]
+        outN[qid[first]] = self.elements[elems[first]]
+        outW[qid[first]] = w[first]
+
+    #--------------------------------------------------------------------------
+    def _boundingBoxes (self):
+        """
+        Element bounding boxes sorted by their west edge (built once)
+        """
+        if self._boxes is None:
+            xt   = self.lon[self.elements]
+            yt   = self.lat[self.elements]
+            xmin, xmax = xt.min(axis=1), xt.max(axis=1)
+            ymin, ymax = yt.min(axis=1), yt.max(axis=1)
+            # pad by the relative edge tolerance of locate
+            padX = 1e-6*(xmax - xmin)
+            padY = 1e-6*(ymax - ymin)
+            order = np.argsort(xmin - padX, kind='stable')
+            self._boxes = {'order' : order,
+                           'xmin'  : (xmin - padX)[order],
+                           'xmax'  : (xmax + padX)[order],
+                           'ymin'  : (ymin - padY)[order],
+                           'ymax'  : (ymax + padY)[order],
+                           'width' : np.max(xmax - xmin + 2*padX) 
+                                     if len(order) else 0.}
+        return self._boxes
+
+    #--------------------------------------------------------------------------
+    def _bruteCandidates (self, xq, yq, chunk=4000000):
+        """
+        Yields (qid, elems) of all elements whose bounding box holds
+        the query points, about chunk candidates at a time
+        """
+        box = self._boundingBoxes()
+        lo  = np.searchsorted(box['xmin'], xq - box['width'], side='left')
+        hi  = np.searchsorted(box['xmin'], xq, side='right')
+        counts = hi - lo
+        q0 = 0
+        while q0 < len(xq):
+            q1  = q0 + max(1, int(np.searchsorted(np.cumsum(counts[q0:]), 
+                                                  chunk, side='right')))
+            qid = np.repeat(np.arange(q0, q1), counts[q0:q1])
+            pos = _expand(lo[q0:q1], counts[q0:q1])
+            ok  = (box['xmax'][pos] >= xq[qid]) & \
+                  (box['ymin'][pos] <= yq[qid]) & (box['ymax'][pos] >= yq[qid])
+            yield qid[ok], box['order'][pos[ok]]
+            q0 = q1
+
+    #--------------------------------------------------------------------------
+    def locate (self, xq, yq, k=8, eps=1e-9):
+        """
+        Finds elements containing the query points.
+        Args:
+            xq, yq (float) : query lon, lat
+            k        (int) : number of nearest nodes whose elements are 
+                             tested first
+            eps    (float) : tolerance on weights for points on element edges
+        Returns:
+            elements (int [NQ])      : 0-based element numbers, -1 if outside
+            nodes    (int [NQ, 3])   : 0-based vertices of these elements
+            weights  (float [NQ, 3]) : barycentric weights (NaN if outside)
+        """
+        xq = np.atleast_1d(np.asarray(xq, dtype=float))
+        yq = np.atleast_1d(np.asarray(yq, dtype=float))
+        nq = len(xq)
+        outE = np.full(nq, -1, dtype=np.int64)
+        outN = np.full([nq, 3], -1, dtype=np.int64)
+        outW = np.full([nq, 3], np.nan)
+
+        _, near = self.pointIndex.nearest(xq, yq, k=k)
+        near    = near.reshape(nq, -1)
+        qid     = np.repeat(np.arange(nq), near.shape[1])
+        near    = near.ravel()
+        qid, near = qid[near >= 0], near[near >= 0]
+
+        offsets, indices = self.nodeElements
+        counts = offsets[near+1] - offsets[near]
+        elems  = indices[_expand(offsets[near], counts)]
+        qid    = np.repeat(qid, counts)
+        self._test(xq, yq, qid, elems, eps, outE, outN, outW)
+
+        # exhaustive test of the rest: only these can still be outside
+        rest = np.nonzero(outE < 0)[0]
+        if len(rest):
+            for qid, elems in self._bruteCandidates(xq[rest], yq[rest]):
+                self._test(xq, yq, rest[qid], elems, eps, outE, outN, outW)
+        return outE, outN, outW
@@ -3,6 +3,8 @@
 """
 
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from csdllib import oper
 
 #==============================================================================
 def rms(V):
@@ -32,12 +34,32 @@ def peak(m, d):
     """    
     return np.nanmax(m) - np.nanmax(d)
 
+#==============================================================================
+def minutes(dt):
+    """
+    Returns time difference (timedelta or np.timedelta64) in minutes
+    """    
+    try:
+        return dt.total_seconds()/60.
+    except AttributeError:
+        return dt/np.timedelta64(1,'m')
+
+#==============================================================================
+def _asDatetime64(dates):
+    """
+    Returns dates (datetime or np.datetime64) as np.datetime64[us] array
+    """
+    t = np.asarray(dates)
+    if np.issubdtype(t.dtype, np.datetime64):
+        return t.astype('datetime64[us]')
+    return np.asarray(t, dtype='datetime64[us]')
+
 #==============================================================================
 def plag(dates, m, d):
     """
     Returns m peak lag occurrence with respect to peak in d, in minutes
     """    
-    return (dates[np.nanargmax(m)] - dates[np.nanargmax(d)]).total_seconds()/60.
+    return minutes(dates[np.nanargmax(m)] - dates[np.nanargmax(d)])
 
 #==============================================================================
 def varExplained(m, d):
@@ -74,7 +96,7 @@ def rValue(m, d):
 def metrics (data, model, dates):
     """    
     data and model (np.arrays) projected on the 
-    same time scale 'dates' (datetime)
+    same time scale 'dates' (datetime or np.datetime64)
     Computes: 
         rmsd - root mean square difference, in data units 
         peak - difference in max values in data and model, in data units
@@ -96,8 +118,7 @@ def metrics (data, model, dates):
     if npts:
         rmsd = rms(model-data)
         peak = np.nanmax(model) - np.nanmax(data)
-        plag = (dates[np.nanargmax(model)] - dates[np.nanargmax(data)]).total_seconds() 
-        plag = plag/60. #in minutes
+        plag = minutes(dates[np.nanargmax(model)] - dates[np.nanargmax(data)])
         bias = np.nanmean(model) - np.nanmean(data)
         vexp = varExplained (model, data)
         skil = skill (model, data)
@@ -111,3 +132,366 @@ def metrics (data, model, dates):
             'skil': skil,
             'rval': rval,
             'npts': npts}
+
+#==============================================================================
+def metricsBatch (data, model, dates):
+    """    
+    Computes metrics() for many stations at once.
+    data and model (np.arrays [NT, NS]) projected on the same time 
+    scale 'dates' ([NT] or [NT, NS], datetime or np.datetime64).
+    NaNs are treated exactly as metrics() does: the valid-pair mask is
+    shared by rmsd, vexp, skil and rval, peak and bias use all values
+    of each series.
+    Returns:
+        dict of np.arrays [NS]: 'rmsd', 'peak', 'plag', 'bias', 'vexp',
+                                'skil', 'rval', 'npts' (see metrics())
+    """
+    d  = np.ma.filled(np.ma.asarray(data,  dtype=float), np.nan)
+    m  = np.ma.filled(np.ma.asarray(model, dtype=float), np.nan)
+    d  = d.reshape(len(d), -1)
+    m  = m.reshape(len(m), -1)
+    ns = d.shape[1]
+    okD  = ~np.isnan(d)
+    okM  = ~np.isnan(m)
+    pair = okD & okM
+    npts = np.count_nonzero(pair, axis=0)
+    nD   = np.count_nonzero(okD, axis=0)
+    nM   = np.count_nonzero(okM, axis=0)
+    dot  = lambda a, b: np.einsum('ij,ij->j', a, b)
+
+    # in-place updates keep the number of [NT, NS] passes low,
+    # as bootstrapMetrics calls this on many resamples
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ad    = np.where(okD, d, 0.)
+        meanD = ad.sum(axis=0) / nD
+        ad   -= meanD
+        np.copyto(ad, 0., where=~okD)
+        am    = np.where(okM, m, 0.)
+        meanM = am.sum(axis=0) / nM
+        am   -= meanM
+        np.copyto(am, 0., where=~okM)
+        diff  = m - d
+        np.copyto(diff, 0., where=~pair)
+        sumE2 = dot(diff, diff)
+        meanE = diff.sum(axis=0) / npts
+        ssD   = dot(ad, ad)
+        ssM   = dot(am, am)
+        diff -= meanE
+        np.copyto(diff, 0., where=~pair)
+        stdD  = np.sqrt(ssD / nD)
+        stdE  = np.sqrt(dot(diff, diff) / npts)
+        rmsd  = np.sqrt(sumE2 / npts)
+        vexp  = np.clip(100.*(stdD - stdE)/stdD, 0., 100.)
+        den   = np.abs(m - meanD)
+        den  += np.abs(ad)
+        np.copyto(den, 0., where=~pair)
+        skil  = 1 - sumE2 / dot(den, den)
+        rval  = dot(ad, am) / (np.sqrt(ssD)*np.sqrt(ssM))
+
+    imaxD = np.argmax(np.where(okD, d, -np.inf), axis=0)
+    imaxM = np.argmax(np.where(okM, m, -np.inf), axis=0)
+    cols  = np.arange(ns)
+    peak  = m[imaxM, cols] - d[imaxD, cols]
+    t     = _asDatetime64(dates)
+    t     = t.reshape(len(t), -1)
+    tcol  = cols if t.shape[1] == ns else np.zeros(ns, dtype=int)
+    plag  = (t[imaxM, tcol] - t[imaxD, tcol]) / np.timedelta64(1, 'm')
+    bias  = meanM - meanD
+
+    result = {'rmsd': rmsd, 
+              'peak': peak,
+              'plag': plag,
+              'bias': bias,
+              'vexp': vexp,
+              'skil': skil,
+              'rval': rval}
+    for key in result:
+        result[key] = np.where(npts > 0, result[key], np.nan)
+    result['npts'] = npts
+    return result
+
+#==============================================================================
+def _merge (nA, meanA, nB, meanB):
+    """
+    Combined count, mean and mean difference of two sets of samples
+    """
+    n = nA + nB
+    with np.errstate(invalid='ignore', divide='ignore'):
+        delta = np.where(nB > 0, meanB - np.where(nA > 0, meanA, 0.), 0.)
+        mean  = np.where(n > 0, np.where(nA > 0, meanA, 0.) + delta*nB/n, 0.)
+        scale = np.where(n > 0, nA*nB/n, 0.)
+    return n, mean, delta, scale
+
+#==============================================================================
+class MetricsAccumulator:
+    """
+    Streaming, mergeable version of metrics() for records that do not fit
+    in memory or are split between workers. Counts, means and centered
+    sums of squares (Welford/Chan updates) are kept per station:
+        acc = MetricsAccumulator()
+        for data, model, dates in chunks:     # [NT] or [NT, NS]
+            acc.update(data, model, dates)
+        acc.merge(otherAcc)                   # e.g. from another process
+        acc.result()                          # same dict as metrics()
+    Skill needs the mean of the whole data record inside an absolute
+    value, so it is only accumulated when dataMean is known, e.g. from
+    a first pass:  MetricsAccumulator(dataMean=acc.dataMean).
+    Otherwise 'skil' is NaN.
+    """
+    #--------------------------------------------------------------------------
+    def __init__ ( self, dataMean=None ):
+        self.dataMean0 = dataMean
+        self.ns = None
+        self.scalar = True
+
+    def _init ( self, ns ):
+        self.ns = ns
+        z = lambda: np.zeros(ns)
+        self.nD, self.meanD, self.m2D = z(), z(), z()   # data, all values
+        self.nM, self.meanM, self.m2M = z(), z(), z()   # model, all values
+        self.nP, self.meanE, self.m2E = z(), z(), z()   # pairs: model-data
+        self.pD, self.pM, self.cDM    = z(), z(), z()   # pairs: co-moment
+        self.skillDen = z()
+        self.maxD = np.full(ns, -np.inf)
+        self.maxM = np.full(ns, -np.inf)
+        self.tD   = np.full(ns, np.datetime64('NaT'), dtype='datetime64[us]')
+        self.tM   = np.full(ns, np.datetime64('NaT'), dtype='datetime64[us]')
+
+    #--------------------------------------------------------------------------
+    def update ( self, data, model, dates ):
+        """
+        Adds a chunk of data and model (np.arrays [NT] or [NT, NS])
+        on the time scale 'dates' ([NT], datetime or np.datetime64)
+        """
+        d = np.ma.filled(np.ma.asarray(data,  dtype=float), np.nan)
+        m = np.ma.filled(np.ma.asarray(model, dtype=float), np.nan)
+        self.scalar = d.ndim == 1
+        d = d.reshape(len(d), -1)
+        m = m.reshape(len(m), -1)
+        if self.ns is None:
+            self._init(d.shape[1])
+        t = _asDatetime64(dates)
+        okD, okM = ~np.isnan(d), ~np.isnan(m)
+        pair = okD & okM
+
+        other = MetricsAccumulator(self.dataMean0)
+        other._init(self.ns)
+        other.scalar = self.scalar
+        with np.errstate(invalid='ignore', divide='ignore'):
+            for ok, x, n, mean, m2 in ((okD, d, 'nD', 'meanD', 'm2D'),
+                                       (okM, m, 'nM', 'meanM', 'm2M'),
+                                       (pair, m - d, 'nP', 'meanE', 'm2E')):
+                cnt = np.count_nonzero(ok, axis=0).astype(float)
+                avg = np.where(cnt > 0, np.where(ok, x, 0.).sum(axis=0)/cnt, 0.)
+                setattr(other, n,    cnt)
+                setattr(other, mean, avg)
+                setattr(other, m2,   np.sum(np.where(ok, x - avg, 0.)**2, axis=0))
+            nP = other.nP
+            other.pD = np.where(nP > 0, np.where(pair, d, 0.).sum(axis=0)/nP, 0.)
+            other.pM = np.where(nP > 0, np.where(pair, m, 0.).sum(axis=0)/nP, 0.)
+            other.cDM = np.sum(np.where(pair, (d - other.pD)*(m - other.pM), 0.),
+                               axis=0)
+            if self.dataMean0 is not None:
+                mu = self.dataMean0
+                other.skillDen = np.sum(np.where(pair, np.abs(m - mu) +
+                                                 np.abs(d - mu), 0.)**2, axis=0)
+        for ok, x, vmax, tmax in ((okD, d, 'maxD', 'tD'), (okM, m, 'maxM', 'tM')):
+            i = np.argmax(np.where(ok, x, -np.inf), axis=0)
+            cols = np.arange(self.ns)
+            has  = ok.any(axis=0)
+            setattr(other, vmax, np.where(has, x[i, cols], -np.inf))
+            setattr(other, tmax, np.where(has, t[i], np.datetime64('NaT')))
+        return self.merge(other)
+
+    #--------------------------------------------------------------------------
+    def merge ( self, other ):
+        """
+        Adds the samples accumulated by other (same stations and dataMean)
+        """
+        if other.ns is None:
+            return self
+        if self.ns is None:
+            self._init(other.ns)
+        self.scalar = getattr(other, 'scalar', True)
+        for n, mean, m2 in (('nD', 'meanD', 'm2D'), ('nM', 'meanM', 'm2M'),
+                            ('nP', 'meanE', 'm2E')):
+            nA, nB = getattr(self, n), getattr(other, n)
+            cnt, avg, delta, scale = _merge(nA, getattr(self, mean),
+                                            nB, getattr(other, mean))
+            setattr(self, m2, getattr(self, m2) + getattr(other, m2) +
+                              delta**2*scale)
+            setattr(self, n, cnt)
+            setattr(self, mean, avg)
+        nA, nB = self.nP - other.nP, other.nP   # nP is already merged
+        _, pD, dD, scale = _merge(nA, self.pD, nB, other.pD)
+        _, pM, dM, _     = _merge(nA, self.pM, nB, other.pM)
+        self.cDM = self.cDM + other.cDM + dD*dM*scale
+        self.pD, self.pM = pD, pM
+        self.skillDen = self.skillDen + other.skillDen
+        # peaks: larger value wins, earlier time on ties
+        for vmax, tmax in (('maxD', 'tD'), ('maxM', 'tM')):
+            vA, vB = getattr(self, vmax), getattr(other, vmax)
+            tA, tB = getattr(self, tmax), getattr(other, tmax)
+            takeB = (vB > vA) | ((vB == vA) & (vB > -np.inf) & (tB < tA))
+            setattr(self, vmax, np.where(takeB, vB, vA))
+            setattr(self, tmax, np.where(takeB, tB, tA))
+        return self
+
+    #--------------------------------------------------------------------------
+    @property
+    def dataMean ( self ):
+        """
+        Mean of all data accumulated so far (for the skill pass)
+        """
+        mean = np.where(self.nD > 0, self.meanD, np.nan)
+        return mean[0] if self.scalar else mean
+
+    def result ( self ):
+        """
+        Returns the same dict as metrics() (of np.arrays [NS] for 2D input)
+        """
+        nP = self.nP
+        with np.errstate(invalid='ignore', divide='ignore'):
+            meanD = self.meanD
+            stdD  = np.sqrt(self.m2D / self.nD)
+            stdE  = np.sqrt(self.m2E / nP)
+            rmsd  = np.sqrt(self.m2E / nP + self.meanE**2)
+            vexp  = np.clip(100.*(stdD - stdE)/stdD, 0., 100.)
+            # co-moment about the means of all values, as in rValue()
+            cov   = self.cDM + nP*(self.pD - meanD)*(self.pM - self.meanM)
+            rval  = cov / (np.sqrt(self.m2D)*np.sqrt(self.m2M))
+            skil  = 1 - (self.m2E + nP*self.meanE**2) / self.skillDen \
+                    if self.dataMean0 is not None else np.full(self.ns, np.nan)
+            result = {'rmsd': rmsd,
+                      'peak': self.maxM - self.maxD,
+                      'plag': (self.tM - self.tD) / np.timedelta64(1, 'm'),
+                      'bias': self.meanM - meanD,
+                      'vexp': vexp,
+                      'skil': skil,
+                      'rval': rval}
+        for key in result:
+            result[key] = np.where(nP > 0, result[key], np.nan)
+        result['npts'] = nP.astype(int)
+        if self.scalar:
+            result = {key : result[key][0] for key in result}
+        return result
+
+#==============================================================================
+def blockIndex (nt, nBoot, blockLength, seed=None):
+    """
+    Moving block bootstrap resamples of the time index 0..nt-1.
+    Each resample is a concatenation of randomly placed blocks of
+    blockLength consecutive samples, cut to nt.
+    Returns:
+        np.array [nBoot, nt] of int
+    """
+    blockLength = int(min(max(blockLength, 1), nt))
+    rng    = np.random.default_rng(seed)
+    nb     = -(-nt // blockLength)
+    starts = rng.integers(0, nt - blockLength + 1, size=(nBoot, nb))
+    idx    = starts[:, :, None] + np.arange(blockLength)
+    return idx.reshape(nBoot, -1)[:, :nt]
+
+#==============================================================================
+_bootState = {}
+
+def _bootInit(d, m, t):
+    _bootState['d'] = d
+    _bootState['m'] = m
+    _bootState['t'] = t
+
+def _bootChunk(idx, s0, s1):
+    """
+    Evaluates metricsBatch for resamples idx [NB, NT] of stations s0:s1
+    at once: the resampled series are columns of one batch.
+    """
+    d  = _bootState['d'][:, s0:s1]
+    m  = _bootState['m'][:, s0:s1]
+    nb, nt = idx.shape
+    ns = s1 - s0
+    rd = d[idx.T].reshape(nt, nb*ns)                        # [NT, NB*NS]
+    rm = m[idx.T].reshape(nt, nb*ns)
+    rt = np.repeat(_bootState['t'][idx.T], ns, axis=1)      # [NT, NB*NS]
+    result = metricsBatch(rd, rm, rt)
+    return {key : result[key].reshape(nb, ns) for key in result}
+
+#==============================================================================
+def bootstrapMetrics (data, model, dates, nBoot=1000, blockLength=None, 
+                      percentiles=(2.5, 97.5), chunkSize=250000, workers=1, 
+                      seed=None):
+    """
+    Block bootstrap confidence intervals of metrics() for many stations.
+    Resample indices are drawn once and shared by all stations (so the
+    station records are resampled jointly), and every chunk of resamples
+    is evaluated by metricsBatch in one vectorized call.
+    Args:
+        data, model (np.arrays [NT, NS]) : as for metricsBatch
+        dates ([NT])                     : datetime or np.datetime64
+        nBoot (int)                      : number of resamples
+        blockLength (int)                : samples per block 
+                                           (default: NT**(1/3))
+        percentiles                      : interval bounds, in %
+        chunkSize (int)                  : number of values evaluated at 
+                                           once (resamples x stations x NT)
+        workers (int)                    : number of processes 
+                                           (1 runs serially)
+        seed                             : for np.random.default_rng
+    Returns:
+        dict: 'estimate'  : metricsBatch(data, model, dates),
+              'intervals' : {metric : np.array [NP, NS]} percentiles of 
+                            the resampled metric (NaN resamples ignored),
+              'percentiles', 'nBoot', 'blockLength'
+    """
+    d  = np.ma.filled(np.ma.asarray(data,  dtype=float), np.nan)
+    m  = np.ma.filled(np.ma.asarray(model, dtype=float), np.nan)
+    d  = d.reshape(len(d), -1)
+    m  = m.reshape(len(m), -1)
+    nt, ns = d.shape
+    t  = _asDatetime64(dates)
+    if t.shape != (nt,) or m.shape != d.shape:
+        oper.sys.msg('e', 'data, model and dates are not aligned.')
+        return
+    if blockLength is None:
+        blockLength = int(np.ceil(nt**(1./3)))
+    # a few hundred thousand values per batch keep the temporaries 
+    # of metricsBatch in cache; large station sets are split as well
+    ss     = min(ns, max(1, chunkSize // nt))
+    nb     = max(1, chunkSize // (nt*ss))
+    idx    = blockIndex(nt, nBoot, blockLength, seed)
+    blocks = [(i, s0, min(s0+ss, ns)) 
+              for i in range(0, nBoot, nb) for s0 in range(0, ns, ss)]
+    tasks  = [(idx[i:i+nb], s0, s1) for i, s0, s1 in blocks]
+    if workers == 1:
+        _bootInit(d, m, t)
+        parts = [_bootChunk(*task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_bootInit,
+                                 initargs=(d, m, t)) as pool:
+            parts = list(pool.map(_bootChunk, *zip(*tasks)))
+    _bootState.clear()
+
+    percentiles = list(percentiles)
+    intervals = {}
+    for key in parts[0]:
+        if key == 'npts':
+            continue
+        boot = np.empty((nBoot, ns))
+        for (i, s0, s1), p in zip(blocks, parts):
+            boot[i:i+len(p[key]), s0:s1] = p[key]
+        ok   = ~np.isnan(boot)
+        srt  = np.sort(boot, axis=0)                      # NaNs go last
+        cnt  = np.count_nonzero(ok, axis=0)
+        pos  = np.outer(np.asarray(percentiles)/100., np.maximum(cnt-1, 0))
+        lo   = np.floor(pos).astype(int)
+        hi   = np.minimum(lo + 1, np.maximum(cnt - 1, 0))
+        col  = np.arange(ns)
+        with np.errstate(invalid='ignore'):
+            pct = srt[lo, col] + (pos - lo)*(srt[hi, col] - srt[lo, col])
+        pct[:, cnt == 0] = np.nan
+        intervals[key] = pct
+
+    return {'estimate'    : metricsBatch(d, m, t),
+            'intervals'   : intervals,
+            'percentiles' : percentiles,
+            'nBoot'       : nBoot,
+            'blockLength' : blockLength}
@@ -3,19 +3,288 @@
 """
 
 import os
+import glob
+import json
+import time
+import shutil
+import hashlib
+import itertools
 import numpy as np
 from datetime import datetime
-from datetime import timedelta
 import netCDF4
+from concurrent.futures import ProcessPoolExecutor
 from csdllib.oper.sys import msg
 
 #==============================================================================
-def readGrid ( gridFile, verbose=1):
+def _readBlock ( f, nLines, nCols, dtype=float, blockLines=1000000 ):
+    """
+    Reads nLines of whitespace-delimited numbers from the open file f
+    in bulk, blockLines at a time, without splitting line by line.
+    Columns beyond nCols (e.g. trailing comments) are ignored.
+    Returns:
+        block (np.array [nLines, nCols], dtype)
+    """
+    block = np.zeros([nLines, nCols], dtype=dtype)
+    for n0 in range(0, nLines, blockLines):
+        n1    = min(n0 + blockLines, nLines)
+        lines = list(itertools.islice(f, n1-n0))
+        if len(lines) != n1-n0:
+            raise ValueError('Unexpected end of file.')
+        try:
+            block[n0:n1] = np.loadtxt(lines, dtype=dtype, ndmin=2,
+                                      usecols=range(nCols), comments=None)
+        except ValueError: # ragged lines: fall back to split()
+            block[n0:n1] = [line.split()[:nCols] for line in lines]
+    return block
+
+#==============================================================================
+def _gridFingerprint ( gridFile, nSamples=16, sampleSize=65536 ):
+    """
+    Identifies the grid file by its path, size, modification time and
+    a SHA-1 hash of its head, tail and nSamples evenly spaced blocks
+    (hashing a multi-GB fort.14 in full would defeat the cache).
+    """
+    size = os.path.getsize(gridFile)
+    sha  = hashlib.sha1()
+    with open(gridFile, 'rb') as f:
+        for offset in np.linspace(0, max(size-sampleSize, 0), nSamples+2):
+            f.seek(int(offset))
+            sha.update(f.read(sampleSize))
+    return {'path'  : os.path.abspath(gridFile),
+            'size'  : size,
+            'mtime' : os.path.getmtime(gridFile),
+            'hash'  : sha.hexdigest()}
+
+#==============================================================================
+def _gridCachePath ( gridFile, cacheDir=None ):
+    """
+    Sidecar location: next to the grid, or in cacheDir
+    under a name keyed by the full path of the grid.
+    """
+    if cacheDir is None:
+        return gridFile + '.cache'
+    key = hashlib.sha1(os.path.abspath(gridFile).encode()).hexdigest()[:16]
+    return os.path.join(cacheDir, os.path.basename(gridFile) + '.' + key + '.cache')
+
+#==============================================================================
+def saveGridCache ( grid, gridFile, cacheDir=None, options=None, verbose=1 ):
+    """
+    Saves the grid dict (as returned by readGrid) to a binary sidecar:
+    a directory with one .npy file per array and meta.json holding
+    scalars and the fingerprint of gridFile.
+    Args:
+        grid (dict)    : parsed grid
+        gridFile (str) : full path to the fort.14 the grid was read from
+        cacheDir (str) : optional directory for the sidecar
+                         (default is gridFile + '.cache')
+        options (dict) : readGrid options the grid was parsed with
+    Returns:
+        cachePath (str), or None if the sidecar could not be written
+    """
+    cachePath = _gridCachePath(gridFile, cacheDir)
+    tmpPath   = cachePath + '.tmp' + str(os.getpid())
+    meta = {'fingerprint' : _gridFingerprint(gridFile),
+            'options'     : options,
+            'scalars'     : {},
+            'arrays'      : []}
+    try:
+        os.makedirs(tmpPath)
+        for key in grid:
+            if isinstance(grid[key], np.ndarray):
+                np.save(os.path.join(tmpPath, key + '.npy'), grid[key])
+                meta['arrays'].append(key)
+            else:
+                meta['scalars'][key] = grid[key]
+        with open(os.path.join(tmpPath, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        if os.path.exists(cachePath):
+            shutil.rmtree(cachePath)
+        os.rename(tmpPath, cachePath)
+    except (OSError, TypeError) as e:
+        msg( 'w','Cannot write grid cache ' + cachePath + ': ' + str(e))
+        shutil.rmtree(tmpPath, ignore_errors=True)
+        return None
+    if verbose:
+        msg( 'i','Grid cache saved to ' + cachePath)
+    return cachePath
+
+#==============================================================================
+def loadGridCache ( gridFile, cacheDir=None, options=None, mmap=True, verbose=1 ):
+    """
+    Loads the grid saved by saveGridCache if the sidecar is still valid
+    for gridFile (same path, size, modification time and hash)
+    and was parsed with the same options.
+    Args:
+        gridFile (str) : full path to fort.14 file
+        cacheDir (str) : optional directory for the sidecar
+        options (dict) : readGrid options the grid should be parsed with
+        mmap    (bool) : memory-map the arrays (copy-on-write)
+    Returns:
+        grid (dict), or None if there is no valid cache
+    """
+    cachePath = _gridCachePath(gridFile, cacheDir)
+    metaFile  = os.path.join(cachePath, 'meta.json')
+    if not os.path.exists(metaFile) or not os.path.exists(gridFile):
+        return None
+    try:
+        with open(metaFile) as f:
+            meta = json.load(f)
+        if meta['fingerprint'] != _gridFingerprint(gridFile) or \
+           meta.get('options') != options:
+            if verbose:
+                msg( 'i','Grid cache ' + cachePath + ' is stale.')
+            return None
+        grid = dict(meta['scalars'])
+        for key in meta['arrays']:
+            npyFile = os.path.join(cachePath, key + '.npy')
+            grid[key] = np.load(npyFile, mmap_mode='c' if mmap else None)
+            if grid[key].ndim == 0:  # memmap of a scalar is awkward to use
+                grid[key] = np.array(grid[key])
+    except (OSError, ValueError, KeyError) as e:
+        msg( 'w','Cannot read grid cache ' + cachePath + ': ' + str(e))
+        return None
+    if verbose:
+        msg( 'i','Grid loaded from cache ' + cachePath)
+    return grid
+
+#==============================================================================
+def _boundaryColumns ( ibtype ):
+    """
+    Number of columns of a normal flow boundary node line for IBTYPE
+    """
+    if ibtype in [3,13,23]:
+        return 3
+    if ibtype in [4,24]:
+        return 5
+    if ibtype in [5,25]:
+        return 8
+    return 1
+
+#==============================================================================
+def _denseBoundaries ( nbdv, segments, ibtype, neta, nvel ):
+    """
+    Packs boundary segments into NOPE x NETA and NBOU x NVEL matrices
+    """
+    nope = len(nbdv)
+    nbou = len(segments)
+    myNBDV       = np.zeros([nope, neta], dtype=int)
+    myNBVV       = np.zeros([nbou, nvel], dtype=int)
+    myBARLANHT   = np.zeros([nbou, nvel], dtype=float)
+    myBARLANCFSP = np.zeros([nbou, nvel], dtype=float)
+    myIBCONN     = np.zeros([nbou, nvel], dtype=int)
+    myBARINHT    = np.zeros([nbou, nvel], dtype=float)
+    myBARINCFSB  = np.zeros([nbou, nvel], dtype=float)
+    myBARINCFSP  = np.zeros([nbou, nvel], dtype=float)
+    myPIPEHT     = np.zeros([nbou, nvel], dtype=float)
+    myPIPECOEF   = np.zeros([nbou, nvel], dtype=float)
+    myPIPEDIAM   = np.zeros([nbou, nvel], dtype=float)
+
+    for k in range(nope):
+        myNBDV[k,:len(nbdv[k])] = nbdv[k]
+
+    for k in range(nbou):
+        block = segments[k]
+        n     = len(block)
+        myNBVV[k,:n] = block[:,0]
+        if ibtype[k] in   [3,13,23]:
+            myBARLANHT  [k,:n] = block[:,1]
+            myBARLANCFSP[k,:n] = block[:,2]
+        elif ibtype[k] in [4,24,5,25]:
+            myIBCONN    [k,:n] = block[:,1]
+            myBARINHT   [k,:n] = block[:,2]
+            myBARINCFSB [k,:n] = block[:,3]
+            myBARINCFSP [k,:n] = block[:,4]
+            if ibtype[k] in [5,25]:
+                myPIPEHT    [k,:n] = block[:,5]
+                myPIPECOEF  [k,:n] = block[:,6]
+                myPIPEDIAM  [k,:n] = block[:,7]
+
+    return {'ElevationBoundaries'           : np.squeeze(myNBDV), 
+            'NormalFlowBoundaries'          : np.squeeze(myNBVV),
+            'ExternalBarrierHeights'        : np.squeeze(myBARLANHT),
+            'ExternalBarrierCFSPs'          : np.squeeze(myBARLANCFSP),
+            'BackFaceNodeNormalFlow'        : np.squeeze(myIBCONN),
+            'InternalBarrierHeights'        : np.squeeze(myBARINHT),
+            'InternallBarrierCFSPs'         : np.squeeze(myBARINCFSP),
+            'InternallBarrierCFSBs'         : np.squeeze(myBARINCFSB),            
+            'CrossBarrierPipeHeights'       : np.squeeze(myPIPEHT),
+            'BulkPipeFrictionFactors'       : np.squeeze(myPIPECOEF),            
+            'CrossBarrierPipeDiameter'      : np.squeeze(myPIPEDIAM)
+            }
+
+#==============================================================================
+def _ragged ( blocks, col=None, dtype=float ):
+    """
+    Concatenates a list of arrays (or of their column col) CSR-style.
+    Returns flat values and offsets, so that block k is
+    values[offsets[k]:offsets[k+1]]
+    """
+    offsets = np.zeros(len(blocks)+1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(b) for b in blocks])
+    values = np.zeros(offsets[-1], dtype=dtype)
+    for k in range(len(blocks)):
+        values[offsets[k]:offsets[k+1]] = blocks[k] if col is None \
+                                          else blocks[k][:,col]
+    return values, offsets
+
+#==============================================================================
+def _compactBoundaries ( nbdv, segments, ibtype, intType, floatType ):
+    """
+    Stores boundary segments CSR-style: flat node arrays with offsets.
+    Barrier and pipe attributes are kept only for the segments 
+    of the types that have them, listed in the *Segments arrays.
+    """
+    grid = dict()
+    grid['ElevationBoundaries'], grid['ElevationBoundaryOffsets'] = \
+        _ragged(nbdv, dtype=intType)
+    grid['NormalFlowBoundaries'], grid['NormalFlowBoundaryOffsets'] = \
+        _ragged(segments, 0, dtype=intType)
+
+    external = np.flatnonzero(np.isin(ibtype, [3,13,23]))
+    internal = np.flatnonzero(np.isin(ibtype, [4,24,5,25]))
+    pipes    = np.flatnonzero(np.isin(ibtype, [5,25]))
+    blocks   = [segments[k] for k in external]
+    grid['ExternalBarrierSegments'] = external
+    grid['ExternalBarrierHeights'], grid['ExternalBarrierOffsets'] = \
+        _ragged(blocks, 1, dtype=floatType)
+    grid['ExternalBarrierCFSPs'] = _ragged(blocks, 2, dtype=floatType)[0]
+
+    blocks   = [segments[k] for k in internal]
+    grid['InternalBarrierSegments'] = internal
+    grid['BackFaceNodeNormalFlow'], grid['InternalBarrierOffsets'] = \
+        _ragged(blocks, 1, dtype=intType)
+    grid['InternalBarrierHeights'] = _ragged(blocks, 2, dtype=floatType)[0]
+    grid['InternallBarrierCFSBs']  = _ragged(blocks, 3, dtype=floatType)[0]
+    grid['InternallBarrierCFSPs']  = _ragged(blocks, 4, dtype=floatType)[0]
+
+    blocks   = [segments[k] for k in pipes]
+    grid['CrossBarrierPipeSegments'] = pipes
+    grid['CrossBarrierPipeHeights'], grid['CrossBarrierPipeOffsets'] = \
+        _ragged(blocks, 5, dtype=floatType)
+    grid['BulkPipeFrictionFactors']  = _ragged(blocks, 6, dtype=floatType)[0]
+    grid['CrossBarrierPipeDiameter'] = _ragged(blocks, 7, dtype=floatType)[0]
+    return grid
+
+#==============================================================================
+def readGrid ( gridFile, verbose=1, bulk=False, cache=False, cacheDir=None,
+               compact=False, intType=int, floatType=float):
     """
     Reads ADCIRC grid file
     
     Args:
         gridFile (str): full path to fort.14 file
+        bulk    (bool): if True, parses node, element and boundary blocks
+                        in bulk straight into numpy arrays
+                        (much faster on large meshes)
+        cache   (bool): if True, loads the grid from its binary sidecar
+                        when it is valid, and writes the sidecar otherwise
+        cacheDir (str): optional directory for the sidecar
+                        (default is next to the grid file)
+        compact (bool): if True, stores boundary tables CSR-style 
+                        (flat node arrays plus *Offsets) instead of 
+                        dense NOPE x NETA and NBOU x NVEL matrices
+        intType, floatType : dtypes of node numbers and of coordinates
+                        and depths (e.g. np.int32, np.float32 to save memory)
     Returns:
         grid (dict): field names according to ADCIRC internal variables:
     http://adcirc.org/home/documentation/users-manual-v50/
@@ -26,7 +295,15 @@ def readGrid ( gridFile, verbose=1):
     if not os.path.exists (gridFile):
         msg( 'error', 'File ' + gridFile + ' does not exist.')
         return
-        
+
+    options = {'compact'   : bool(compact),
+               'intType'   : np.dtype(intType).str,
+               'floatType' : np.dtype(floatType).str}
+    if cache:
+        grid = loadGridCache(gridFile, cacheDir, options, verbose=verbose)
+        if grid is not None:
+            return grid
+
     f  = open(gridFile)
     
     myDesc     = f.readline().rstrip()
@@ -35,55 +312,55 @@ def readGrid ( gridFile, verbose=1):
         msg( 'i','Grid description ' + myDesc + '.')
         msg( 'i','Grid size: NE= '   + str(myNE) + ', NP=' + str(myNP) + '.')
 
-    myPoints   = np.zeros([myNP,3], dtype=float)
-    myElements = np.zeros([myNE,3], dtype=int)
+    myPoints   = np.zeros([myNP,3], dtype=floatType)
+    myElements = np.zeros([myNE,3], dtype=intType)
     
     if verbose:
         msg( 'i','Reading grid points...')
 
-    for k in range(myNP):
-        line            = f.readline().split()
-        myPoints[k,0] = float(line[1])
-        myPoints[k,1] = float(line[2])
-        myPoints[k,2] = float(line[3])
+    if bulk:
+        myPoints[:] = _readBlock(f, myNP, 4)[:,1:]
+    else:
+        for k in range(myNP):
+            line            = f.readline().split()
+            myPoints[k,0] = float(line[1])
+            myPoints[k,1] = float(line[2])
+            myPoints[k,2] = float(line[3])
 
     if verbose:
         msg( 'i','Reading grid elements...')
 
-    for k in range(myNE):
-        line              = f.readline().split()
-        #myElements[k,0:2] = map(int, line[2:4])
-        myElements[k,0] = int (line[2])
-        myElements[k,1] = int (line[3])
-        myElements[k,2] = int (line[4])
+    if bulk:
+        myElements[:] = _readBlock(f, myNE, 5, dtype=int)[:,2:]
+    else:
+        for k in range(myNE):
+            line              = f.readline().split()
+            #myElements[k,0:2] = map(int, line[2:4])
+            myElements[k,0] = int (line[2])
+            myElements[k,1] = int (line[3])
+            myElements[k,2] = int (line[4])
     
     myNOPE   = int(f.readline().split()[0])
     myNETA   = int(f.readline().split()[0])   
     myNVDLL  = np.zeros([myNOPE], dtype=int)
-    myNBDV   = np.zeros([myNOPE, myNETA], dtype=int)
+    myNBDV   = []
     
     if verbose:
         msg('i', 'Reading elevation-specified boundaries...')
 
     for k in range(myNOPE):
         myNVDLL [k] = int(f.readline().split()[0])
-        for j in range(myNVDLL[k]):
-            myNBDV[k,j] = int(f.readline().strip())
+        if bulk:
+            myNBDV.append(_readBlock(f, myNVDLL[k], 1, dtype=int)[:,0])
+        else:
+            myNBDV.append(np.array([int(f.readline().strip()) 
+                                    for j in range(myNVDLL[k])], dtype=int))
 
     myNBOU = int(f.readline().split()[0])
     myNVEL = int(f.readline().split()[0])   
     myNVELL      = np.zeros([myNBOU], dtype=int)
     myIBTYPE     = np.zeros([myNBOU], dtype=int)
-    myNBVV       = np.zeros([myNBOU, myNVEL], dtype=int)
-    myBARLANHT   = np.zeros([myNBOU, myNVEL], dtype=float)
-    myBARLANCFSP = np.zeros([myNBOU, myNVEL], dtype=float)
-    myIBCONN     = np.zeros([myNBOU, myNVEL], dtype=int)
-    myBARINHT    = np.zeros([myNBOU, myNVEL], dtype=float)
-    myBARINCFSB  = np.zeros([myNBOU, myNVEL], dtype=float)
-    myBARINCFSP  = np.zeros([myNBOU, myNVEL], dtype=float)
-    myPIPEHT     = np.zeros([myNBOU, myNVEL], dtype=float)
-    myPIPECOEF   = np.zeros([myNBOU, myNVEL], dtype=float)
-    myPIPEDIAM   = np.zeros([myNBOU, myNVEL], dtype=float)
+    mySegments   = []
     
     if verbose:
         msg('i', 'Reading normal flow-specified boundaries...')
@@ -91,34 +368,16 @@ def readGrid ( gridFile, verbose=1):
         line = f.readline().split()
         myNVELL[k]  = int(line[0])
         myIBTYPE[k] = int(line[1])
-        
-        for j in range(myNVELL[k]):
-            line = f.readline().rstrip().split()            
-            if myIBTYPE[k] in   [0,1,2,10,11,12,20,21,22,30]:
-                myNBVV      [k,j] = int(line[0])
-            elif myIBTYPE[k] in [3,13,23]:
-                myNBVV      [k,j] = int  (line[0])
-                myBARLANHT  [k,j] = float(line[1])
-                myBARLANCFSP[k,j] = float(line[2])
-            elif myIBTYPE[k] in [4,24]:
-                myNBVV      [k,j] = int  (line[0])
-                myIBCONN    [k,j] = int  (line[1])
-                myBARINHT   [k,j] = float(line[2])
-                myBARINCFSB [k,j] = float(line[3])
-                myBARINCFSP [k,j] = float(line[4])
-            elif myIBTYPE[k] in [5,25]:
-                myNBVV      [k,j] = int  (line[0])
-                myIBCONN    [k,j] = int  (line[1])
-                myBARINHT   [k,j] = float(line[2])
-                myBARINCFSB [k,j] = float(line[3])
-                myBARINCFSP [k,j] = float(line[4])
-                myPIPEHT    [k,j] = float(line[5])
-                myPIPECOEF  [k,j] = float(line[6])
-                myPIPEDIAM  [k,j] = float(line[7])
-
+        nCols       = _boundaryColumns(myIBTYPE[k])
+        if bulk:
+            mySegments.append(_readBlock(f, myNVELL[k], nCols))
+        else:
+            mySegments.append(np.array([f.readline().split()[:nCols] 
+                                        for j in range(myNVELL[k])], 
+                                       dtype=float).reshape(-1, nCols))
     f.close()
         
-    return {'GridDescription'               : myDesc, 
+    grid = {'GridDescription'               : myDesc, 
             'NE'                            : myNE, 
             'NP'                            : myNP, 
             'lon'                           : np.squeeze(myPoints[:,0]),
@@ -127,24 +386,188 @@ def readGrid ( gridFile, verbose=1):
             'Elements'                      : np.squeeze(myElements),
             'NETA'                          : myNETA, 
             'NOPE'                          : myNOPE,
-            'ElevationBoundaries'           : np.squeeze(myNBDV), 
-            'NormalFlowBoundaries'          : np.squeeze(myNBVV),
-            'ExternalBarrierHeights'        : np.squeeze(myBARLANHT),
-            'ExternalBarrierCFSPs'          : np.squeeze(myBARLANCFSP),
-            'BackFaceNodeNormalFlow'        : np.squeeze(myIBCONN),
-            'InternalBarrierHeights'        : np.squeeze(myBARINHT),
-            'InternallBarrierCFSPs'         : np.squeeze(myBARINCFSP),
-            'InternallBarrierCFSBs'         : np.squeeze(myBARINCFSB),            
-            'CrossBarrierPipeHeights'       : np.squeeze(myPIPEHT),
-            'BulkPipeFrictionFactors'       : np.squeeze(myPIPECOEF),            
-            'CrossBarrierPipeDiameter'      : np.squeeze(myPIPEDIAM)
+            'NVDLL'                         : myNVDLL,
+            'NVEL'                          : myNVEL, 
+            'NBOU'                          : myNBOU,
+            'NVELL'                         : myNVELL,
+            'IBTYPE'                        : myIBTYPE
             }
+    if compact:
+        grid.update(_compactBoundaries(myNBDV, mySegments, myIBTYPE, 
+                                       intType, floatType))
+    else:
+        grid.update(_denseBoundaries(myNBDV, mySegments, myIBTYPE, 
+                                     myNETA, myNVEL))
+    if cache:
+        saveGridCache(grid, gridFile, cacheDir, options, verbose=verbose)
+    return grid
+
+
+#==============================================================================
+def findStations ( names, stations ):
+    """
+    Finds positions of the requested stations in the list of names.
+    Args:
+        names          : station names as stored in the file
+        stations       : station numbers (0-based) or names
+    Returns:
+        index (np.array of int)
+    """
+    names = [str(n).strip() for n in names]
+    index = []
+    for s in np.atleast_1d(np.asarray(stations, dtype=object)):
+        if isinstance(s, (int, np.integer)):
+            index.append(int(s))
+            continue
+        s = str(s).strip()
+        if s in names:
+            index.append(names.index(s))
+        else: # e.g. NOS ID within the station description
+            match = [n for n in range(len(names)) if s in names[n]]
+            if not match:
+                raise KeyError('Station ' + s + ' is not found.')
+            index.append(match[0])
+    return np.array(index, dtype=int)
+
+#==============================================================================
+def findTimeWindow ( tim, baseDate, dateRange ):
+    """
+    Finds the slice of the model time (seconds since baseDate) 
+    within dateRange (datetime or np.datetime64, ...), inclusive.
+    """
+    if dateRange is None:
+        return slice(0, len(tim))
+    base  = np.datetime64(baseDate, 's')
+    start = (np.datetime64(dateRange[0], 's') - base) / np.timedelta64(1, 's')
+    end   = (np.datetime64(dateRange[1], 's') - base) / np.timedelta64(1, 's')
+    return slice(int(np.searchsorted(tim, start, side='left')),
+                 int(np.searchsorted(tim, end,   side='right')))
+
+#==============================================================================
+class LazyTimeSeries:
+    """
+    Handle on a fort.61.nc-like file that reads only what is accessed:
+    station names, coordinates and time on first use, and values
+    only for the requested stations and time window.
+        ts = openTimeSeries(ncFile)
+        ts.stations                      # names only
+        ts.read(['8518750'], (d0, d1))   # same dict as readTimeSeries
+    """
+    #--------------------------------------------------------------------------
+    def __init__ ( self, ncFile, ncVar='zeta' ):
+        self.path  = ncFile
+        self.ncVar = ncVar
+        self.nc    = netCDF4.Dataset( ncFile )
+        self._stations = None
+        self._tim      = None
+
+    def __enter__ ( self ):
+        return self
+
+    def __exit__ ( self, *args ):
+        self.close()
+
+    def close ( self ):
+        self.nc.close()
+
+    #--------------------------------------------------------------------------
+    @property
+    def stations ( self ):
+        if self._stations is None:
+            nam = self.nc.variables['station_name'][:]
+            self._stations = netCDF4.chartostring(nam)  # Python3 requirement?
+        return self._stations
+
+    @property
+    def base_date ( self ):
+        return _baseDate(self.nc.variables['time'])
+
+    @property
+    def tim ( self ):
+        if self._tim is None:
+            self._tim = np.asarray(self.nc.variables['time'][:])
+        return self._tim
+
+    @property
+    def time ( self ):
+        return _timeAxis(self.base_date, self.tim)
+
+    @property
+    def time64 ( self ):
+        return _timeAxis(self.base_date, self.tim, datetime64=True)
 
+    #--------------------------------------------------------------------------
+    def read ( self, stations=None, dateRange=None, datetime64=False,
+               dtype=None ):
+        """
+        Reads the variable for the stations (numbers or names) 
+        within dateRange (datetime, datetime); all by default.
+        'time' is np.datetime64 array if datetime64 is True.
+        If dtype (e.g. np.float32) is given, values are decoded straight 
+        into a plain array of that type, see _readField.
+        Returns:
+            dict: 'lat', 'lon', 'time', 'base_date', 'zeta', 'stations', 'title'
+        """
+        nc       = self.nc
+        baseDate = self.base_date
+        window   = findTimeWindow(self.tim, baseDate, dateRange)
+        if stations is None:
+            index = slice(None)
+            names = self.stations
+        else:
+            index = findStations(self.stations, stations)
+            # netCDF reads want increasing indices
+            index, inverse = np.unique(index, return_inverse=True)
+
+        if dtype is not None:
+            fld = _readField(nc.variables[self.ncVar], dtype, window, (index,))
+        else:
+            fld        = nc.variables[self.ncVar][window, index]
+            missingVal = nc.variables[self.ncVar]._FillValue
+            try:
+                fld.unshare_mask()
+            except:
+                pass
+            fld [np.where(fld == missingVal)] = np.nan
+
+        lon  = nc.variables['x'][index]
+        lat  = nc.variables['y'][index]
+        if stations is not None:
+            fld, lon, lat = fld[:, inverse], lon[inverse], lat[inverse]
+            names = self.stations[index][inverse]
+
+        return  {'lat'       : lat, 
+                 'lon'       : lon, 
+                 'time'      : _timeAxis(baseDate, self.tim[window], datetime64), 
+                 'base_date' : baseDate, 
+                 'zeta'      : fld, 
+                 'stations'  : names,
+                 'title'     : nc.getncattr('title')}
 
 #==============================================================================
-def readTimeSeries (ncFile, ncVar = 'zeta', verbose=1):
+def openTimeSeries (ncFile, ncVar = 'zeta', verbose=1):
+    """
+    Opens fort.61.nc-like file for lazy reading, see LazyTimeSeries
+    """
+    if verbose:
+        msg( 'i','Opening [' + ncVar + '] in ' + ncFile)
+    if not os.path.exists (ncFile):
+        msg( 'e','File ' + ncFile + ' does not exist.')
+        return
+    return LazyTimeSeries(ncFile, ncVar)
+
+#==============================================================================
+def readTimeSeries (ncFile, ncVar = 'zeta', verbose=1, 
+                    stations=None, dateRange=None, datetime64=False,
+                    dtype=None):
     """
     Reads fort.61.nc-like file
+    Args:
+        stations   : optional station numbers (0-based) or names to read
+        dateRange  : optional (datetime, datetime) window to read
+        datetime64 : return 'time' as np.datetime64 array (default False)
+        dtype      : e.g. np.float32, read values into a plain NaN-filled 
+                     array of this type instead of a masked array
     """
     if verbose:
         msg( 'i','Reading [' + ncVar + '] from ' + ncFile)
@@ -152,49 +575,134 @@ def readTimeSeries (ncFile, ncVar = 'zeta', verbose=1):
         msg( 'e','File ' + ncFile + ' does not exist.')
         return
     
-    nc    = netCDF4.Dataset( ncFile )
-    fld        = nc.variables[ncVar][:]
-    missingVal = nc.variables[ncVar]._FillValue
-    try:
-        fld.unshare_mask()
-    except:
-        pass
-    fld [np.where(fld == missingVal)] = np.nan
-                          
-    lon  = nc.variables['x'][:]
-    lat  = nc.variables['y'][:]    
-    tim  = nc.variables['time'][:]    
-    nam  = nc.variables['station_name'][:]
-    stations = netCDF4.chartostring(nam)  # Python3 requirement?
+    with LazyTimeSeries(ncFile, ncVar) as ts:
+        return ts.read(stations, dateRange, datetime64, dtype)
+    
+#==============================================================================
+def _readCycle ( ncFile, ncVar, dtype ):
+    """
+    Reads one cycle file for aggregateTimeSeries (runs in a worker process)
+    """
+    with LazyTimeSeries(ncFile, ncVar) as ts:
+        ts = ts.read(datetime64=True, dtype=dtype)
+    ts['stations'] = [str(n).strip() for n in ts['stations']]
+    ts['lon'] = np.ma.filled(np.ma.asarray(ts['lon'], dtype=float), np.nan)
+    ts['lat'] = np.ma.filled(np.ma.asarray(ts['lat'], dtype=float), np.nan)
+    return ts
 
-    ncTitle  = nc.getncattr('title')
-    try:
-        baseDate = datetime.strptime(nc.variables['time'].base_date[0:19], 
-                                 '%Y-%m-%d %H:%M:%S')
-    except: # when 00 sec is not written at all
-        baseDate = datetime.strptime(nc.variables['time'].base_date[0:19], 
-                                 '%Y-%m-%d %H:%M  ')
+#==============================================================================
+def aggregateTimeSeries ( files, ncVar = 'zeta', rule = 'latest', 
+                          nowcastHours = 6., workers = None, 
+                          dtype = np.float64, datetime64 = False, verbose=1 ):
+    """
+    Stitches station time series from consecutive cycles of fort.61.nc-like
+    files onto one time line. Stations are aligned by name, files are read
+    in parallel, and the output is allocated once.
+    Args:
+        files (list or str)  : cycle files, or a glob pattern
+        rule (str)           : how overlapping periods are resolved:
+            'latest'  - the value from the latest cycle wins
+            'nowcast' - only the first nowcastHours of every cycle are 
+                        kept (latest wins if these still overlap)
+        nowcastHours (float) : see rule='nowcast'
+        workers (int)        : number of reading processes 
+                               (default: os.cpu_count(); 1 reads serially)
+        dtype                : type of 'zeta'
+        datetime64 (bool)    : return 'time' as np.datetime64 array
+    Returns:
+        dict: 'lat', 'lon', 'time', 'base_date', 'zeta', 'stations', 'title'
+              as readTimeSeries, with 'zeta' [NT, NSTATIONS] (NaN where 
+              a station is not in a cycle), and 'cycle' [NT] - the index
+              of the latest file (in 'files') that covers each time. 
+    """
+    if isinstance(files, str):
+        files = sorted(glob.glob(files))
+    if rule not in ('latest', 'nowcast'):
+        msg( 'e','Unknown rule ' + str(rule) + '.')
+        return
+    if not len(files):
+        msg( 'e','No cycle files to aggregate.')
+        return
+    missing = [f for f in files if not os.path.exists(f)]
+    if missing:
+        msg( 'e','Files ' + str(missing) + ' do not exist.')
+        return
+    if verbose:
+        msg( 'i','Aggregating [' + ncVar + '] from ' + str(len(files)) + 
+                 ' cycles.')
 
-    realtime = np.array([baseDate + 
-                         timedelta(seconds=int(tim[i])) 
-                         for i in range(len(tim))])
+    args = ([ncFile, ncVar, dtype] for ncFile in files)
+    if workers == 1:
+        cycles = [_readCycle(*a) for a in args]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            cycles = list(pool.map(_readCycle, *zip(*args)))
 
-    return  {'lat'       : lat, 
-             'lon'       : lon, 
-             'time'      : realtime, 
+    # Cycles in the order of their start time, latest last 
+    starts = [c['time'][0] if len(c['time']) else np.datetime64('NaT') 
+              for c in cycles]
+    order  = sorted([n for n in range(len(cycles)) 
+                     if not np.isnat(starts[n])], key=lambda n: starts[n])
+    keep   = {}
+    for n in order:
+        tim = cycles[n]['time']
+        if rule == 'nowcast':
+            end = starts[n] + np.timedelta64(int(3600*nowcastHours), 's')
+            keep[n] = tim < end
+        else:
+            keep[n] = np.ones(len(tim), dtype=bool)
+
+    # Union of stations (by name) and of times
+    stations = []
+    column   = {}
+    lon      = []
+    lat      = []
+    for n in order:
+        c = cycles[n]
+        for k, name in enumerate(c['stations']):
+            if name not in column:
+                column[name] = len(stations)
+                stations.append(name)
+                lon.append(c['lon'][k])
+                lat.append(c['lat'][k])
+    tim = np.unique(np.concatenate([cycles[n]['time'][keep[n]] 
+                                    for n in order] + 
+                                   [np.array([], dtype='datetime64[s]')]))
+
+    zeta  = np.full((len(tim), len(stations)), np.nan, dtype=dtype)
+    cycle = np.full(len(tim), -1, dtype=int)
+    for n in order:
+        c    = cycles[n]
+        rows = np.searchsorted(tim, c['time'][keep[n]])
+        cols = np.array([column[name] for name in c['stations']], dtype=int)
+        zeta [rows[:,None], cols[None,:]] = c['zeta'][keep[n]]
+        cycle[rows] = n
+
+    baseDate = cycles[order[0]]['base_date'] if order else None
+    if not datetime64:
+        tim = tim.astype(datetime)
+    return  {'lat'       : np.array(lat), 
+             'lon'       : np.array(lon), 
+             'time'      : tim, 
              'base_date' : baseDate, 
-             'zeta'      : fld, 
-             'stations'  : stations,
-             'title'     : ncTitle}        
-    
+             'zeta'      : zeta, 
+             'stations'  : np.array(stations),
+             'title'     : cycles[0]['title'],
+             'cycle'     : cycle}
+
 #==============================================================================
-def readSurfaceField ( ncFile, ncVar = 'zeta_max', verbose=1 ):  
+def readSurfaceField ( ncFile, ncVar = 'zeta_max', verbose=1, 
+                       datetime64=False, dtype=None ):  
     """
     Reads specified variable from the ADCIRC 2D netCDF output
     and grid points along with validation time.
     Args:
         'ncFile' (str): full path to netCDF file
         'ncVar'  (str): name of netCDF field
+        'datetime64' (bool): return 'time' as np.datetime64 array
+        'dtype'  : e.g. np.float32, read 'value' into a plain NaN-filled 
+                   array of this type instead of a masked array 
+                   (about half the peak memory)
     Returns:
         dict: 'lon', 'lat', 'time', 'base_date', 'value', 'path', 'variable'
     """
@@ -210,24 +718,20 @@ def readSurfaceField ( ncFile, ncVar = 'zeta_max', verbose=1 ):
     lon  = nc.variables['x'][:]
     lat  = nc.variables['y'][:]
     tim  = nc.variables['time'][:]
-    fld  = nc.variables[ncVar][:] 
-
-    missingVal = nc.variables[ncVar]._FillValue
-    try:
-        fld.unshare_mask()
-    except:
-        pass
-    fld [fld==missingVal] = np.nan
+    if dtype is not None:
+        fld = _readField(nc.variables[ncVar], dtype)
+    else:
+        fld  = nc.variables[ncVar][:] 
 
-    d = nc.variables['time'].base_date[0:19].strip()
-    if len(d)==19:
-        baseDate = datetime.strptime(d,'%Y-%m-%d %H:%M:%S')
-    if len(d)==16:
-        baseDate = datetime.strptime(d,'%Y-%m-%d %H:%M')
+        missingVal = nc.variables[ncVar]._FillValue
+        try:
+            fld.unshare_mask()
+        except:
+            pass
+        fld [fld==missingVal] = np.nan
 
-    realtime = np.array([baseDate +
-                         timedelta(seconds=int(tim[i]))
-                         for i in range(len(tim))])
+    baseDate = _baseDate(nc.variables['time'])
+    realtime = _timeAxis(baseDate, tim, datetime64)
 
     return { 'lon'      : lon, 
              'lat'      : lat, 
@@ -237,6 +741,222 @@ def readSurfaceField ( ncFile, ncVar = 'zeta_max', verbose=1 ):
              'path'     : ncFile,              
              'variable' : ncVar}
 
+#==============================================================================
+def _baseDate ( timeVar ):
+    """
+    Parses base_date attribute of the netCDF time variable
+    """
+    d = timeVar.base_date[0:19].strip()
+    if len(d) == 16: # when 00 sec is not written at all
+        return datetime.strptime(d, '%Y-%m-%d %H:%M')
+    return datetime.strptime(d, '%Y-%m-%d %H:%M:%S')
+
+#==============================================================================
+def _timeAxis ( baseDate, tim, datetime64=False ):
+    """
+    Converts model time (seconds since baseDate) to dates, 
+    as np.datetime64[s] array or (default) array of datetime objects
+    """
+    sec   = np.trunc(np.asarray(tim, dtype=float)).astype(np.int64)
+    dates = np.datetime64(baseDate, 's') + sec.astype('timedelta64[s]')
+    if datetime64:
+        return dates
+    return dates.astype(datetime)
+
+#==============================================================================
+def _readField ( var, dtype=np.float32, first=slice(None), rest=(), 
+                 blockSize=262144 ):
+    """
+    Reads var[first, *rest] into a preallocated array of dtype, 
+    blockSize values at a time along the first dimension. Values are 
+    read raw (no masked array) and fill values become NaN while each 
+    block is decoded, so the only full-size array is the result.
+    """
+    fill  = getattr(var, '_FillValue', 
+                    netCDF4.default_fillvals.get(var.dtype.str[1:]))
+    scale = getattr(var, 'scale_factor', None)
+    shift = getattr(var, 'add_offset',   None)
+    rows  = range(*first.indices(var.shape[0]))
+    step  = max(1, blockSize // max(1, int(np.prod(var.shape[1:]))))
+
+    var.set_auto_maskandscale(False)
+    try:
+        out = None
+        for n in range(0, len(rows), step):
+            r0  = rows.start + n*rows.step
+            r1  = r0 + min(step, len(rows) - n)*rows.step
+            raw = var[(slice(r0, r1, rows.step),) + tuple(rest)]
+            if out is None:
+                out = np.empty((len(rows),) + raw.shape[1:], dtype=dtype)
+            blk = out[n:n+len(raw)]
+            blk[...] = raw
+            if fill is not None:
+                blk[raw == fill] = np.nan
+            if 'missing_value' in var.ncattrs():
+                blk[raw == var.missing_value] = np.nan
+            if scale is not None:
+                blk *= scale
+            if shift is not None:
+                blk += shift
+    finally:
+        var.set_auto_maskandscale(True)
+    if out is None:
+        out = np.empty((0,) + var[(slice(0, 0),) + tuple(rest)].shape[1:], 
+                       dtype=dtype)
+    return out
+
+#==============================================================================
+def readVirtualGauges ( ncFile, lon, lat, names=None, grid=None, 
+                        ncVar='zeta', chunkSize=None, verbose=1, 
+                        datetime64=False, chunkValues=4194304 ):
+    """
+    Extracts time series at arbitrary points (virtual gauges) from
+    the ADCIRC full-field output (e.g. fort.63.nc), interpolating 
+    linearly within the elements that contain the points (nearest node
+    for points not located in any element). Dry nodes are left out of the weights.
+    The time dimension is read chunkSize records at a time and decoded 
+    without masked copies; only the nodes around the points are kept,
+    so memory is bounded by chunkSize x NP (about chunkValues values).
+    Args:
+        'ncFile' (str)   : full path to netCDF file
+        'lon', 'lat'     : coordinates of the points
+        'names'          : names of the points (e.g. from readStationsList)
+        'grid'           : Grid or readGrid dict; default is the mesh 
+                           stored in ncFile ('x', 'y', 'element')
+        'ncVar' (str)    : name of netCDF field
+        'chunkSize'(int) : number of time records read at once
+                           (default: chunkValues values, at least 1 record)
+        'datetime64'     : return 'time' as np.datetime64 array
+    Returns:
+        dict: 'lat', 'lon', 'time', 'base_date', 'zeta', 'stations', 'title'
+              as readTimeSeries, with 'zeta' [NT, NPOINTS]
+    """
+    from csdllib.models.grid import Grid
+
+    if verbose:
+        msg( 'i','Extracting [' + ncVar + '] from ' + ncFile)
+    if not os.path.exists (ncFile):
+        msg( 'e','File ' + ncFile + ' does not exist.')
+        return
+
+    nc  = netCDF4.Dataset( ncFile )
+    if grid is None:
+        grid = {'lon'      : nc.variables['x'][:],
+                'lat'      : nc.variables['y'][:],
+                'Elements' : nc.variables['element'][:]}
+    if not isinstance(grid, Grid):
+        grid = Grid(grid)
+
+    lon = np.atleast_1d(np.asarray(lon, dtype=float))
+    lat = np.atleast_1d(np.asarray(lat, dtype=float))
+    elems, nodes, weights = grid.locate(lon, lat)
+    unlocated = elems < 0
+    if np.any(unlocated):
+        if verbose:
+            msg( 'w', str(np.count_nonzero(unlocated)) + 
+                 ' points were not located in any element,' + 
+                 ' using nearest nodes.')
+        nodes  [unlocated] = grid.nearestNodes(lon[unlocated], 
+                                               lat[unlocated])[1][:,None]
+        weights[unlocated] = [1., 0., 0.]
+
+    var  = nc.variables[ncVar]
+    NT, NP = var.shape
+    zeta = np.zeros([NT, len(lon)], dtype=float)
+    if chunkSize is None:
+        chunkSize = max(1, chunkValues // NP)
+    # whole records are read: ADCIRC output is chunked by record, and
+    # picking scattered columns across many records thrashes the 
+    # chunk cache
+    for t0 in range(0, NT, chunkSize):
+        t1   = min(t0 + chunkSize, NT)
+        vals = _readField(var, np.float64, 
+                          slice(t0, t1))[:, nodes]      # [nt, npoints, 3]
+        w    = np.where(np.isnan(vals), 0., weights)
+        with np.errstate(invalid='ignore'):
+            zeta[t0:t1] = np.nansum(w*vals, axis=2) / np.sum(w, axis=2)
+
+    baseDate = _baseDate(nc.variables['time'])
+    realtime = _timeAxis(baseDate, nc.variables['time'][:], datetime64)
+    if names is None:
+        names = [str(n+1) for n in range(len(lon))]
+    title = nc.getncattr('title') if 'title' in nc.ncattrs() else ''
+    nc.close()
+
+    return  {'lat'       : lat, 
+             'lon'       : lon, 
+             'time'      : realtime, 
+             'base_date' : baseDate, 
+             'zeta'      : zeta, 
+             'stations'  : np.asarray(names),
+             'title'     : title}
+
+#==============================================================================
+def _asciiHeader ( f ):
+    """
+    Reads the two header lines of ADCIRC ASCII output (fort.61/63/64,
+    maxele.63, ...) from the open file f
+    """
+    desc = f.readline().strip()
+    line = f.readline().split()
+    return {'description' : desc,
+            'NDSETSE'     : int(line[0]),
+            'NP'          : int(line[1]),
+            'DT'          : float(line[2]) if len(line) > 2 else np.nan,
+            'NSPOOL'      : int(line[3])   if len(line) > 3 else 0,
+            'IRTYPE'      : int(line[4])   if len(line) > 4 else 1}
+
+#==============================================================================
+def _asciiDatasets ( f, header, fill_value=-99999.0 ):
+    """
+    Yields datasets of ADCIRC ASCII output from the open file f,
+    positioned after the header. Reads both full and sparse
+    ('TIME IT NNONDEFAULT DEFAULT') dataset layouts.
+    """
+    NP   = header['NP']
+    nCol = max(1, header['IRTYPE'])
+    n    = 0
+    while header['NDSETSE'] < 0 or n < header['NDSETSE']:
+        line = f.readline().split()
+        if not line:  # NDSETSE can be more than actually written
+            return
+        if len(line) >= 4: # sparse dataset
+            block = _readBlock(f, int(line[2]), nCol + 1)
+            value = np.full([NP, nCol], float(line[3]))
+            value[block[:,0].astype(int) - 1] = block[:,1:]
+        else:
+            value = _readBlock(f, NP, nCol + 1)[:,1:]
+        value[value == fill_value] = np.nan
+        if nCol == 1:
+            value = value[:,0]
+        yield {'time'  : float(line[0]),
+               'it'    : int(float(line[1])),
+               'value' : value}
+        n += 1
+
+#==============================================================================
+def iterSurfaceField_ascii ( asciiFile, verbose=1 ):
+    """
+    Reads ADCIRC ASCII output (e.g. fort.63, maxele.63) one dataset at a
+    time, so that a multi-GB file can be processed in constant memory:
+        for d in iterSurfaceField_ascii('fort.63'):
+            vmax = np.fmax(vmax, d['value'])
+    Args:
+        'asciiFile' (str): full path to ADCIRC 2D file in ASCII format
+    Yields:
+        dict: 'time' (sec), 'it' (time step), 'value' (np.array [NP] or 
+              [NP, IRTYPE] for vector output), with NaN for -99999.
+    """
+    if verbose:
+        msg( 'i','Reading ASCII file ' + asciiFile + '.')
+    if not os.path.exists (asciiFile):
+        msg( 'e','File ' + asciiFile + ' does not exist.')
+        return
+    with open(asciiFile) as f:
+        header = _asciiHeader(f)
+        for dataset in _asciiDatasets(f, header):
+            yield dataset
+
 #==============================================================================
 def readSurfaceField_ascii ( asciiFile, verbose=1 ):
     """
@@ -251,35 +971,375 @@ def readSurfaceField_ascii ( asciiFile, verbose=1 ):
         msg( 'i','Reading ASCII file ' + asciiFile + '.')
 
     f  = open(asciiFile)
+    header = _asciiHeader(f)
+    msg( 'i','Field description [' + header['description'] + '].')
+    value = [d['value'] for d in _asciiDatasets(f, header)]
+    f.close()
+    if not len(value):
+        return np.zeros([header['NP'], 0])
+    value = np.stack(value, axis=-1)
     
-    myDesc = f.readline().strip()
-    msg( 'i','Field description [' + myDesc + '].')
-    line          = f.readline().split()    
-    myNDSETSE     = int(line[0])
-    myNP          = int(line[1])
-#    myNSPOOLGE    = int(line[3])
-#    myIRTYPE      = int(line[4])
-#    dtdpXnspoolge = float(line[2])   
-    line          = f.readline().split()
-#    myTIME        = float(line[0])
-#    myIT          = float(line[1])
-    value = np.zeros([myNP,myNDSETSE], dtype=float)
-    for s in range(myNDSETSE):
-        for n in range(myNP):
-            value[n,s] = float(f.readline().split()[1])    
-    value = np.squeeze(value)
-    
-    fill_value = -99999.0
-    value[value==fill_value]=np.nan
+    return np.squeeze(value)
+
+#==============================================================================
+def asciiToNetcdf ( asciiFile, ncFile, baseDate, grid=None, stations=None, 
+                    ncVar='zeta', maxele=False, chunkSizes=None, complevel=4, 
+                    dtype='f8', verbose=1 ):
+    """
+    Converts ADCIRC ASCII output (fort.61, fort.63, fort.64, maxele.63, ...)
+    into a compressed netCDF4 file laid out as the netCDF ADCIRC output, 
+    so that readTimeSeries, readSurfaceField, LazyTimeSeries etc. can read 
+    it. Datasets are streamed one at a time, memory does not depend on 
+    the number of datasets.
+    Args:
+        'asciiFile' (str) : full path to ADCIRC ASCII file
+        'ncFile'    (str) : full path to netCDF file to write
+        'baseDate' (datetime) : model cold start date (not in ASCII files)
+        'grid'            : Grid, readGrid dict or path to fort.14, 
+                            for full-field outputs (dimension 'node')
+        'stations' (dict) : readStationsList() output, for station 
+                            outputs (dimension 'station')
+        'ncVar'           : name of the variable, or list of names 
+                            of the vector components (e.g. ['u-vel','v-vel'])
+        'maxele' (bool)   : write datasets as separate [node] variables,
+                            ncVar and 'time_of_' + ncVar, as in maxele.63.nc
+        'chunkSizes'      : (time, node) chunk shape; default is about 
+                            256K values, up to 4096 nodes wide, which keeps 
+                            both snapshot and time series reads short
+        'complevel' (int) : zlib compression level (0 - no compression)
+    Returns:
+        ncFile (str)
+    """
+    if verbose:
+        msg( 'i','Converting ' + asciiFile + ' to ' + ncFile)
+    if not os.path.exists (asciiFile):
+        msg( 'e','File ' + asciiFile + ' does not exist.')
+        return
+    if isinstance(grid, str):
+        grid = readGrid(grid, verbose=verbose)
+    if grid is None and stations is None:
+        msg( 'e','Either grid or stations is needed for coordinates.')
+        return
+
+    f      = open(asciiFile)
+    header = _asciiHeader(f)
+    NP     = header['NP']
+    dim    = 'node' if stations is None else 'station'
+    names  = [ncVar] if isinstance(ncVar, str) else list(ncVar)
+    if maxele:
+        names = [names[0], 'time_of_' + names[0]]
+    elif len(names) != max(1, header['IRTYPE']):
+        msg( 'e','Expected ' + str(header['IRTYPE']) + ' variable names.')
+        f.close()
+        return
+
+    nc = netCDF4.Dataset(ncFile, 'w', format='NETCDF4')
+    nc.title       = header['description']
+    nc.source      = os.path.basename(asciiFile)
+    nc.createDimension('time', None)
+    nc.createDimension(dim, NP)
+    zlib = complevel > 0
     
+    tim = nc.createVariable('time', 'f8', ('time',))
+    tim.long_name = 'model time'
+    tim.units     = baseDate.strftime('seconds since %Y-%m-%d %H:%M:%S')
+    tim.base_date = baseDate.strftime('%Y-%m-%d %H:%M:%S')
+    if stations is None:
+        lon, lat = grid['lon'], grid['lat']
+    else:
+        lon, lat = stations['lon'], stations['lat']
+    if len(lon) != NP:
+        msg( 'e','Coordinates do not match ' + str(NP) + ' points.')
+        nc.close()
+        f.close()
+        return
+    nc.createVariable('x', 'f8', (dim,), zlib=zlib, complevel=complevel)[:] = lon
+    nc.createVariable('y', 'f8', (dim,), zlib=zlib, complevel=complevel)[:] = lat
+    if stations is not None:
+        nam = np.array([str(n).strip().encode() for n in stations['name']])
+        L   = max(1, nam.dtype.itemsize)
+        nc.createDimension('namelen', L)
+        nc.createVariable('station_name', 'S1', (dim, 'namelen'))[:] = \
+            nam.astype('S' + str(L)).view('S1').reshape(NP, L)
+    else:
+        nc.createVariable('depth', 'f8', (dim,), zlib=zlib, 
+                          complevel=complevel)[:] = grid['depth']
+        nc.createDimension('nele', len(grid['Elements']))
+        nc.createDimension('nvertex', 3)
+        nc.createVariable('element', 'i4', ('nele', 'nvertex'), zlib=zlib,
+                          complevel=complevel)[:] = grid['Elements']
+
+    if chunkSizes is None:
+        width      = min(NP, 4096)
+        chunkSizes = (max(1, 262144 // width), width)
+    out = []
+    for name in names:
+        if maxele:
+            v = nc.createVariable(name, dtype, (dim,), zlib=zlib, 
+                                  complevel=complevel, fill_value=-99999.)
+        else:
+            v = nc.createVariable(name, dtype, ('time', dim), zlib=zlib, 
+                                  complevel=complevel, fill_value=-99999.,
+                                  chunksizes=chunkSizes)
+        out.append(v)
+
+    n = 0
+    for dataset in _asciiDatasets(f, header):
+        value = np.ma.masked_invalid(dataset['value'].reshape(NP, -1))
+        if maxele:
+            if n < len(out):
+                out[n][:] = value[:,0]
+            if n == 0:
+                tim[0] = dataset['time']
+        else:
+            tim[n] = dataset['time']
+            for k, v in enumerate(out):
+                v[n] = value[:,k]
+        n += 1
     f.close()
-    
-    return value 
+    nc.close()
+    if verbose:
+        msg( 'i','Converted ' + str(n) + ' datasets.')
+    return ncFile
 
 #==============================================================================
 def computeMax (fields):
     return np.amax(fields, axis=0)
 
+#==============================================================================
+def computeExtremes ( ncFile, ncVar='zeta', chunkSize=None, threshold=None,
+                      verbose=1, datetime64=False, chunkValues=4194304 ):
+    """
+    Computes per-node maximum, minimum, time of maximum and hours above
+    a threshold of the ADCIRC time-dependent 2D output (e.g. fort.63.nc)
+    in one pass over the time dimension, chunkSize records at a time,
+    so memory does not depend on the number of records. Chunks are
+    decoded by _readField (no masked copies) and reduced record by record,
+    so the peak is about one chunk plus a few [NP] arrays.
+    Args:
+        'ncFile' (str)    : full path to netCDF file
+        'ncVar'  (str)    : name of netCDF field
+        'chunkSize' (int) : number of time records read at once
+                            (default: chunkValues values, at least 1 record)
+        'threshold'       : level for 'hours_above' (in field units)
+        'datetime64'      : return 'time' as np.datetime64 array
+    Returns:
+        dict: 'lon', 'lat', 'time', 'base_date', 'value' (maximum), 
+              'path', 'variable' as readSurfaceField, and
+              'min', 'time_of_max' (sec since base_date, as in maxele.63),
+              'hours_above' (time spent above threshold, if given).
+              Nodes that are never wet are NaN.
+    """
+    if verbose:
+        msg( 'i','Reducing [' + ncVar + '] from ' + ncFile)
+    if not os.path.exists (ncFile):
+        msg( 'e','File ' + ncFile + ' does not exist.')
+        return
+
+    nc   = netCDF4.Dataset (ncFile)
+    var  = nc.variables[ncVar]
+    tim  = np.asarray(nc.variables['time'][:], dtype=float)
+    NT, NP = var.shape
+    # each record stands for the interval since the previous one
+    step = np.diff(tim, prepend=tim[0] - (tim[1]-tim[0] if NT > 1 else 0.))/3600.
+
+    vmax  = np.full(NP, -np.inf)
+    vmin  = np.full(NP,  np.inf)
+    tmax  = np.full(NP, np.nan)
+    hours = np.zeros(NP) if threshold is not None else None
+    if chunkSize is None:
+        chunkSize = max(1, chunkValues // max(NP, 1))
+    for t0 in range(0, NT, chunkSize):
+        t1    = min(t0 + chunkSize, NT)
+        chunk = _readField(var, np.float64, slice(t0, t1))
+        # NaN (dry) compares False, and the first maximum is kept
+        with np.errstate(invalid='ignore'):
+            for n, rec in enumerate(chunk):
+                later = rec > vmax
+                np.copyto(vmax, rec, where=later)
+                np.copyto(tmax, tim[t0 + n], where=later)
+                np.fmin(vmin, rec, out=vmin)
+                if hours is not None:
+                    hours[rec > threshold] += step[t0 + n]
+        del chunk
+
+    vmax[np.isinf(vmax)] = np.nan
+    vmin[np.isinf(vmin)] = np.nan
+    if hours is not None:
+        hours[np.isnan(vmax)] = np.nan
+
+    baseDate = _baseDate(nc.variables['time'])
+    result = { 'lon'        : nc.variables['x'][:], 
+               'lat'        : nc.variables['y'][:], 
+               'time'       : _timeAxis(baseDate, tim, datetime64),
+               'base_date'  : baseDate,
+               'value'      : vmax, 
+               'min'        : vmin,
+               'time_of_max': tmax,
+               'hours_above': hours,
+               'path'       : ncFile,              
+               'variable'   : ncVar}
+    nc.close()
+    return result
+
+#==============================================================================
+def compareSurfaceFields ( ncFile1, ncFile2, ncVar='zeta_max', regions=None,
+                           tolerance=0.01, outFile=None, blockSize=262144,
+                           verbose=1 ):
+    """
+    Compares a 2D field (e.g. zeta_max) of two runs on the same mesh
+    node block by node block, so that memory is bounded by blockSize 
+    and does not depend on the mesh size. 
+    Args:
+        'ncFile1', 'ncFile2' (str) : reference and test run, as for 
+                                     readSurfaceField
+        'ncVar'  (str)      : name of netCDF field [node]
+        'regions' (dict)    : {name : (lonlim, latlim)} bounding boxes
+                              (as in plot.map) or {name : mask [NP] bool};
+                              'all' (the whole mesh) is always added
+        'tolerance' (float) : |difference| counted as a change
+        'outFile'  (str)    : write the difference (test - reference) 
+                              into this netCDF file as ncVar, readable by 
+                              readSurfaceField; if None, the difference is 
+                              returned as 'value' (a full [NP] array)
+        'blockSize' (int)   : number of nodes compared at once
+    Returns:
+        dict: 'regions' {name : {'rms', 'bias', 'max_abs', 
+                                 'max_abs_lon', 'max_abs_lat',
+                                 'changed' (fraction of nodes wet in 
+                                 either run that differ by more than 
+                                 tolerance or are wet in one run only),
+                                 'npts' (nodes wet in both runs),
+                                 'wet1', 'wet2' (nodes wet in one run only)}},
+              'value' or 'path', 'variable', 'tolerance'
+    """
+    for ncFile in (ncFile1, ncFile2):
+        if not os.path.exists (ncFile):
+            msg( 'e','File ' + ncFile + ' does not exist.')
+            return
+    if verbose:
+        msg( 'i','Comparing [' + ncVar + '] of ' + ncFile2 + 
+                 ' against ' + ncFile1)
+
+    nc1  = netCDF4.Dataset(ncFile1)
+    nc2  = netCDF4.Dataset(ncFile2)
+    var1 = nc1.variables[ncVar]
+    var2 = nc2.variables[ncVar]
+    NP   = var1.shape[0]
+    if var1.shape != var2.shape or var1.ndim != 1:
+        msg( 'e','Fields ' + str(var1.shape) + ' and ' + str(var2.shape) + 
+                 ' are not on the same mesh, interpolate one of them first.')
+        nc1.close()
+        nc2.close()
+        return
+
+    regions = dict({'all' : None}, **dict(regions or {}))
+    keys  = ('n', 'sum', 'sum2', 'max_abs', 'max_abs_lon', 'max_abs_lat', 
+             'changed', 'wet1', 'wet2')
+    stats = {name : dict.fromkeys(keys, 0.) for name in regions}
+    for name in regions:
+        stats[name]['max_abs'] = -1.
+
+    out = None
+    if outFile is not None:
+        out = netCDF4.Dataset(outFile, 'w', format='NETCDF4')
+        out.title  = 'Difference of ' + ncVar + ': ' + \
+                     os.path.basename(ncFile2) + ' - ' + \
+                     os.path.basename(ncFile1)
+        out.createDimension('time', None)
+        out.createDimension('node', NP)
+        tim = out.createVariable('time', 'f8', ('time',))
+        for attr in nc1.variables['time'].ncattrs():
+            tim.setncattr(attr, nc1.variables['time'].getncattr(attr))
+        tim[:] = nc1.variables['time'][:]
+        for name in ('x', 'y', 'depth'):
+            if name in nc1.variables:
+                out.createVariable(name, 'f8', ('node',), zlib=True)
+        diffVar = out.createVariable(ncVar, 'f4', ('node',), zlib=True, 
+                                     fill_value=-99999.)
+    else:
+        value = np.full(NP, np.nan)
+
+    for n0 in range(0, NP, blockSize):
+        n1  = min(n0 + blockSize, NP)
+        v1  = _readField(var1, np.float64, slice(n0, n1))
+        v2  = _readField(var2, np.float64, slice(n0, n1))
+        lon = _readField(nc1.variables['x'], np.float64, slice(n0, n1))
+        lat = _readField(nc1.variables['y'], np.float64, slice(n0, n1))
+        ok1 = ~np.isnan(v1)
+        ok2 = ~np.isnan(v2)
+        both = ok1 & ok2
+        diff = v2 - v1
+        with np.errstate(invalid='ignore'):
+            changed = (np.abs(diff) > tolerance) | (ok1 ^ ok2)
+        if out is not None:
+            diffVar[n0:n1] = np.ma.masked_invalid(diff)
+            out.variables['x'][n0:n1] = lon
+            out.variables['y'][n0:n1] = lat
+            if 'depth' in out.variables:
+                out.variables['depth'][n0:n1] = \
+                    nc1.variables['depth'][n0:n1]
+        else:
+            value[n0:n1] = diff
+
+        for name, region in regions.items():
+            if region is None:
+                inside = np.ones(n1 - n0, dtype=bool)
+            elif isinstance(region, (tuple, list)) and len(region) == 2:
+                lonlim, latlim = region
+                inside = (lonlim[0] <= lon) & (lon <= lonlim[1]) & \
+                         (latlim[0] <= lat) & (lat <= latlim[1])
+            else:
+                inside = np.asarray(region[n0:n1], dtype=bool)
+            st  = stats[name]
+            sel = inside & both
+            d   = diff[sel]
+            st['n']       += len(d)
+            st['sum']     += d.sum()
+            st['sum2']    += np.dot(d, d)
+            st['changed'] += np.count_nonzero(inside & changed)
+            st['wet1']    += np.count_nonzero(inside & ok1 & ~ok2)
+            st['wet2']    += np.count_nonzero(inside & ok2 & ~ok1)
+            if len(d):
+                i = np.argmax(np.abs(d))
+                if abs(d[i]) > st['max_abs']:
+                    st['max_abs']     = abs(d[i])
+                    st['max_abs_lon'] = lon[sel][i]
+                    st['max_abs_lat'] = lat[sel][i]
+    nc1.close()
+    nc2.close()
+    if out is not None:
+        out.close()
+
+    result = {}
+    for name, st in stats.items():
+        n   = st['n']
+        wet = n + st['wet1'] + st['wet2']
+        result[name] = {
+            'rms'         : np.sqrt(st['sum2']/n) if n else np.nan,
+            'bias'        : st['sum']/n if n else np.nan,
+            'max_abs'     : st['max_abs'] if n else np.nan,
+            'max_abs_lon' : st['max_abs_lon'] if n else np.nan,
+            'max_abs_lat' : st['max_abs_lat'] if n else np.nan,
+            'changed'     : st['changed']/wet if wet else np.nan,
+            'npts'        : int(n),
+            'wet1'        : int(st['wet1']),
+            'wet2'        : int(st['wet2'])}
+        if verbose:
+            msg( 'i','Region ' + name + ': rms=' + 
+                     str(np.round(result[name]['rms'], 4)) + ', bias=' + 
+                     str(np.round(result[name]['bias'], 4)) + ', changed ' + 
+                     str(np.round(100.*result[name]['changed'], 2)) + '%')
+
+    comparison = {'regions'   : result,
+                  'variable'  : ncVar,
+                  'tolerance' : tolerance}
+    if out is not None:
+        comparison['path'] = outFile
+    else:
+        comparison['value'] = value
+    return comparison
+
 """
 #==============================================================================
 def computeMax (ncFile, ncVar='zeta'):
@@ -293,11 +1353,13 @@ def computeMax (ncFile, ncVar='zeta'):
 """
 
 #==============================================================================
-def readFort14 ( fort14file ):
+def readFort14 ( fort14file, bulk=False, cache=False, compact=False, 
+                 cacheDir=None, intType=int, floatType=float ):
     """
-    Reads ADCIRC fort.14 file
+    Reads ADCIRC fort.14 file (options as in readGrid)
     """
-    return readGrid (fort14file)
+    return readGrid (fort14file, bulk=bulk, cache=cache, cacheDir=cacheDir,
+                     compact=compact, intType=intType, floatType=floatType)
 
 #==============================================================================
 def readStationsList (fileName):
@@ -462,17 +1524,23 @@ def readFort15 ( fort15file, verbose=1 ):
             }
 
 #==============================================================================
-def writeOffset63 ( val, offset63file, note=None):
+def writeOffset63 ( val, offset63file, note=None, precision=None ):
     """
     Writes ADCIRC offset.63 file in ASCII format
     for use with pseudo pressure loading option
     Args:
-        val (float)        : Array of gridded values 
+        val (float)        : Array of gridded values [NP], 
+                             or [NDSETS, NP] for several datasets
         offset63file (str) : Full path to the output file
+        precision (int)    : number of decimals; default (None) writes 
+                             values as str() does
     Note:
         val should be the same size and order as your grid vectors
     """
     msg( 'i','Writing Offset63 file...')
+    val  = np.asarray(val)
+    sets = val.reshape(-1, val.shape[-1]) if val.ndim > 1 else [val]
+    fmt  = '%d %s\n' if precision is None else '%d %.' + str(precision) + 'f\n'
     f = open(offset63file,'w')
     if note is None:
         f.write("# ADCIRC Offset file\n")
@@ -480,15 +1548,114 @@ def writeOffset63 ( val, offset63file, note=None):
         f.write("# " + note + "\n")
     f.write("1.0\n")  # ADCIRC Version 55
     f.write("1.0\n")    
-    for n in range(len(val)):
-        f.write(str(n+1) + ' ' + str(val[n]) + '\n')
+    for k, v in enumerate(sets):
+        if k:
+            f.write("##\n")
+        # interleave node numbers and values and format them in one go
+        line = np.empty(2*len(v), dtype=object)
+        line[0::2] = range(1, len(v)+1)
+        line[1::2] = v.tolist() if v.dtype == np.float64 else list(v)
+        f.write((fmt*len(v)) % tuple(line))
     f.close()
     return None
 
 #==============================================================================
-def readOffset63 ( offset63file):
-    msg( 'e','readOffset63() is not yet implemented.')
-    return None
+def readOffset63 ( offset63file, verbose=1 ):
+    """
+    Reads ADCIRC offset.63 file written by writeOffset63
+    Args:
+        offset63file (str) : Full path to the file
+    Returns:
+        val (np.array [NP], or [NDSETS, NP] for several datasets)
+    """
+    if verbose:
+        msg( 'i','Reading Offset63 file ' + offset63file)
+    if not os.path.exists (offset63file):
+        msg( 'e','File ' + offset63file + ' does not exist.')
+        return
+    f = open(offset63file)
+    for n in range(3): # comment and two header values
+        f.readline()
+    # '##' dataset separators are skipped as comments, 
+    # a new dataset starts where the node numbers restart
+    data = np.loadtxt(f, comments='#', ndmin=2, usecols=(0,1))
+    f.close()
+    nodes  = data[:,0].astype(int) - 1
+    starts = np.flatnonzero(np.diff(nodes) <= 0) + 1
+    sets   = np.split(np.arange(len(nodes)), starts)
 
+    NP  = int(nodes.max()) + 1 if len(nodes) else 0
+    val = np.zeros([len(sets), NP])
+    for k, s in enumerate(sets):
+        val[k, nodes[s]] = data[s,1]
+    return val[0] if len(sets) == 1 else val
 
+#==============================================================================
+def createOffset63 ( offset63file, grid, anomalyFile, dates=None, p=2, k=8,
+                     taper=None, z_full=None, z_zero=None, blockSize=100000,
+                     note=None, precision=None, verbose=1 ):
+    """
+    Creates ADCIRC offset.63 file from CO-OPS water level anomalies:
+    anomalies -> IDW onto the mesh (k nearest stations, blockSize nodes 
+    at a time) -> depth taper -> offset.63. Time spent in each stage 
+    is reported and returned.
+    Args:
+        offset63file (str) : Full path to the output file
+        grid               : Grid, readGrid dict or path to fort.14
+        anomalyFile (str)  : anomaly table (coops.createAnomalyTable); 
+                             it is (re)created from CO-OPS if dates 
+                             (datetime, datetime) are given
+        p, k (int)         : IDW power and number of nearest stations
+        taper (str)        : None, 'linear' or 'exp' (interp.taperLinear,
+                             interp.taperExp between z_full and z_zero)
+        precision (int)    : see writeOffset63
+    Returns:
+        dict: 'value' (offsets at the nodes), 'stations' (anomaly table),
+              'timing' (seconds per stage)
+    """
+    from csdllib.data import coops
+    from csdllib.methods import interp
 
+    timing = {}
+    t0 = time.time()
+    if dates is not None:
+        coops.createAnomalyTable(anomalyFile, dates)
+    if not os.path.exists (anomalyFile):
+        msg( 'e','File ' + anomalyFile + ' does not exist.')
+        return
+    stations = coops.readAnomalyTable(anomalyFile)
+    timing['anomalies'] = time.time() - t0
+    if not len(stations['bias']):
+        msg( 'e','No anomalies in ' + anomalyFile)
+        return
+
+    t0 = time.time()
+    if isinstance(grid, str):
+        grid = readGrid(grid, verbose=verbose)
+    timing['grid'] = time.time() - t0
+
+    t0 = time.time()
+    value = interp.idw(stations['lon'], stations['lat'], stations['bias'],
+                       grid['lon'], grid['lat'], p=p, k=k, 
+                       chunkSize=blockSize)
+    timing['interpolation'] = time.time() - t0
+
+    t0 = time.time()
+    if taper == 'linear':
+        value = interp.taperLinear(z_full, z_zero, grid['depth'], value)
+    elif taper == 'exp':
+        value = interp.taperExp(z_full, z_zero, grid['depth'], value)
+    elif taper is not None:
+        msg( 'w','Unknown taper ' + str(taper) + ', not applied.')
+    timing['taper'] = time.time() - t0
+
+    t0 = time.time()
+    writeOffset63(value, offset63file, note=note, precision=precision)
+    timing['write'] = time.time() - t0
+
+    if verbose:
+        for stage in timing:
+            msg( 'i', stage + ': ' + '%.2f' % timing[stage] + ' sec')
+    return {'value'    : value,
+            'stations' : stations,
+            'timing'   : timing}
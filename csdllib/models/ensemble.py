@@ -0,0 +1,149 @@
+"""
+Ensemble statistics over model members (e.g. ETSS/ESTOFS maxele.63.nc)
+
+@author: Sergey.Vinogradov@noaa.gov
+"""
+import os
+import glob
+import numpy as np
+import netCDF4
+from concurrent.futures import ProcessPoolExecutor
+from csdllib.oper.sys import msg
+from csdllib.models import adcirc
+
+#==============================================================================
+def _reduceBlock ( files, ncVar, n0, n1, percentiles, thresholds, dtype ):
+    """
+    Reads nodes n0:n1 of ncVar from every member and reduces them
+    (runs in a worker process). Only one block of all members is in memory.
+    """
+    block = np.empty((len(files), n1-n0), dtype=dtype)
+    for m, ncFile in enumerate(files):
+        nc = netCDF4.Dataset(ncFile)
+        block[m] = adcirc._readField(nc.variables[ncVar], dtype,
+                                     slice(n0, n1))
+        nc.close()
+
+    valid = ~np.isnan(block)
+    count = np.count_nonzero(valid, axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        total = np.where(valid, block, 0.).sum(axis=0, dtype=float)
+        mean  = total / count
+        std   = np.sqrt(np.where(valid, (block - mean)**2, 0.).sum(axis=0)
+                        / count)
+    result = {'mean'  : mean,
+              'std'   : std,
+              'min'   : np.where(count > 0,
+                                 np.where(valid, block, np.inf).min(axis=0),
+                                 np.nan),
+              'max'   : np.where(count > 0,
+                                 np.where(valid, block, -np.inf).max(axis=0),
+                                 np.nan),
+              'count' : count}
+    if len(percentiles):
+        # sort once, NaNs (dry members) go last; linear interpolation
+        # between the wet members as in np.nanpercentile
+        srt = np.sort(block, axis=0)
+        pos = np.outer(np.asarray(percentiles)/100., count - 1)  # [NP, B]
+        lo  = np.clip(np.floor(pos).astype(int), 0, len(files)-1)
+        hi  = np.clip(lo + 1, 0, np.maximum(count - 1, 0))
+        col = np.arange(n1-n0)
+        frac = pos - lo
+        with np.errstate(invalid='ignore'):
+            pct = srt[lo, col] + frac*(srt[hi, col] - srt[lo, col])
+        pct[:, count == 0] = np.nan
+        result['percentiles'] = pct
+    with np.errstate(invalid='ignore'):
+        result['probability'] = np.array([np.sum(block > t, axis=0)
+                                          for t in thresholds], dtype=float
+                                         ).reshape(len(thresholds), n1-n0) \
+                                / len(files)
+    return result
+
+#==============================================================================
+def ensembleStats ( files, ncVar = 'zeta_max', percentiles = (10, 50, 90),
+                    thresholds = (), blockSize = 100000, workers = None,
+                    dtype = np.float32, verbose=1 ):
+    """
+    Computes ensemble statistics of a 2D field (e.g. zeta_max) over the
+    members, node block by node block, with blocks reduced in parallel
+    worker processes. Every block is read from all members at once, so the
+    percentiles are exact and memory is bounded by
+    workers x members x blockSize values.
+    Args:
+        files (list or str)  : member files (as for readSurfaceField),
+                               or a glob pattern
+        ncVar (str)          : name of netCDF field [node]
+        percentiles          : percentiles of the wet members, in %
+        thresholds           : levels for exceedance probability
+        blockSize (int)      : number of nodes reduced at once
+        workers (int)        : number of processes
+                               (default: os.cpu_count(); 1 runs serially)
+        dtype                : type used to read the members
+    Returns:
+        dict: 'lon', 'lat', 'mean', 'std' (spread), 'min', 'max',
+              'count' (number of wet members),
+              'percentiles' {p : field},
+              'probability' {threshold : fraction of members above it},
+              'members', 'variable'.
+              Statistics ignore dry (NaN) members; probability counts
+              them as not exceeding.
+    """
+    if isinstance(files, str):
+        files = sorted(glob.glob(files))
+    if not len(files):
+        msg( 'e','No ensemble members to reduce.')
+        return
+    missing = [f for f in files if not os.path.exists(f)]
+    if missing:
+        msg( 'e','Files ' + str(missing) + ' do not exist.')
+        return
+    if verbose:
+        msg( 'i','Reducing [' + ncVar + '] over ' + str(len(files)) +
+                 ' members.')
+
+    nc  = netCDF4.Dataset(files[0])
+    NP  = len(nc.dimensions[nc.variables[ncVar].dimensions[0]])
+    lon = nc.variables['x'][:]
+    lat = nc.variables['y'][:]
+    nc.close()
+    for ncFile in files[1:]:
+        nc = netCDF4.Dataset(ncFile)
+        if nc.variables[ncVar].shape != (NP,):
+            msg( 'e','Member ' + ncFile + ' is not on the same grid.')
+            nc.close()
+            return
+        nc.close()
+
+    percentiles = list(percentiles)
+    thresholds  = list(thresholds)
+    blocks = [(n0, min(n0 + blockSize, NP)) for n0 in range(0, NP, blockSize)]
+    args   = [[files, ncVar, n0, n1, percentiles, thresholds, dtype]
+              for n0, n1 in blocks]
+    stats = {key : np.full(NP, np.nan)
+             for key in ('mean', 'std', 'min', 'max')}
+    stats['count'] = np.zeros(NP, dtype=int)
+    pct  = np.full((len(percentiles), NP), np.nan)
+    prob = np.zeros((len(thresholds), NP))
+
+    def store ( results ):
+        for (n0, n1), r in zip(blocks, results):
+            for key in stats:
+                stats[key][n0:n1] = r[key]
+            if len(percentiles):
+                pct [:, n0:n1] = r['percentiles']
+            prob[:, n0:n1] = r['probability']
+
+    if workers == 1:
+        store(map(lambda a: _reduceBlock(*a), args))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            store(pool.map(_reduceBlock, *zip(*args)))
+
+    stats.update({'lon'         : lon,
+                  'lat'         : lat,
+                  'percentiles' : dict(zip(percentiles, pct)),
+                  'probability' : dict(zip(thresholds, prob)),
+                  'members'     : files,
+                  'variable'    : ncVar})
+    return stats
@@ -2,7 +2,7 @@
 @author: Sergey.Vinogradov@noaa.gov
 """
 
-import os, csv, shutil, glob
+import os, shutil, glob
 import tarfile
 import numpy as np
 from datetime import datetime
@@ -53,10 +53,26 @@ def readStations (tarFile, verbose=1):
     return stations
 
 #==============================================================================
-def readStation (csvFile, verbose=1):
+def _parseDates (stamps):
+    """
+    Converts YYYYMMDDHHMM integer time stamps to np.datetime64[m] array
+    """
+    stamps = np.asarray(stamps, dtype=np.int64)
+    year   = stamps // 100000000
+    month  = stamps // 1000000 % 100
+    day    = stamps // 10000 % 100
+    hour   = stamps // 100 % 100
+    minute = stamps % 100
+    months = ((year - 1970)*12 + month - 1).astype('datetime64[M]')
+    return months.astype('datetime64[m]') + \
+           ((day - 1)*1440 + hour*60 + minute).astype('timedelta64[m]')
+
+#==============================================================================
+def readStation (csvFile, verbose=1, datetime64=False):
     """
     Reads one station data from csvFile
     Returns lists of dates and corresponding time series values
+    ('time' is np.datetime64 array if datetime64 is True)
     Skips obs
     """
     if verbose:
@@ -67,32 +83,20 @@ def readStation (csvFile, verbose=1):
 
     nosid = os.path.splitext(os.path.basename(csvFile))[0]
     missingVal = 9999.
-    dtime    = []
-    tide     = []
-    surge    = []
-    bias     = []
-    twl      = []
-    with open( csvFile ) as csvfile:
-        data = csv.reader(csvfile, delimiter=',')
-        next(data, None)
+    # TIME, TIDE, OB, SURGE, BIAS, TWL
+    data = np.loadtxt(csvFile, delimiter=',', skiprows=1, ndmin=2)
+    data = data.reshape(-1, 6)
+    data[data == missingVal] = np.nan
+    data = data[~np.isnan(data[:,5])]
 
-        for row in data:
-            row = [np.nan if float(x) == missingVal else x for x in row]
-            TIME, TIDE, OB, SURGE, BIAS, TWL = row
-            if TWL is np.nan:
-                pass
-            else:
-                dtime.append   ( datetime.strptime(TIME,'%Y%m%d%H%M') )
-                tide.append    ( float (TIDE) )
-                surge.append   ( float(SURGE) )
-                bias.append    ( float(BIAS) )
-                twl.append     ( float(TWL) )
-        csvfile.close()
+    dtime = _parseDates(data[:,0])
+    if not datetime64:
+        dtime = dtime.astype(datetime).tolist()
     return  {'time'      : dtime, 
-             'htp'       : tide,
-             'swl'       : surge,
-             'cwl'       : twl,
-             'bias'      : bias,
+             'htp'       : data[:,1].tolist(),
+             'swl'       : data[:,3].tolist(),
+             'cwl'       : data[:,5].tolist(),
+             'bias'      : data[:,4].tolist(),
              'nosid'     : nosid}        
 
         
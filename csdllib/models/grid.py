@@ -0,0 +1,196 @@
+"""
+@author: Sergey.Vinogradov@noaa.gov
+"""
+
+import numpy as np
+from functools import cached_property
+from csdllib.models import adcirc
+from csdllib.methods import spatial
+
+#==============================================================================
+def _csr ( rows, cols, nrows ):
+    """
+    Builds CSR adjacency (offsets, indices) from (rows, cols) pairs,
+    so that row n is indices[offsets[n]:offsets[n+1]]
+    """
+    order   = np.lexsort((cols, rows))
+    offsets = np.zeros(nrows+1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(rows, minlength=nrows))
+    return offsets, cols[order]
+
+#==============================================================================
+class Grid:
+    """
+    ADCIRC mesh topology around the readGrid() dict.
+    Adjacency, edges, areas and centroids are computed on first use,
+    vectorized, and cached. Node and element numbers are 0-based here,
+    unlike grid['Elements'].
+    Grid can be used in place of the dict: grid['lon'] etc. still work.
+    """
+    #--------------------------------------------------------------------------
+    def __init__ ( self, grid, **kwargs ):
+        """
+        Args:
+            grid (dict or str): readGrid() output, or full path to fort.14;
+                                kwargs are passed to readGrid in that case
+        """
+        if isinstance(grid, str):
+            grid = adcirc.readGrid(grid, **kwargs)
+        self.grid = grid
+        self.lon  = np.asarray(grid['lon'])
+        self.lat  = np.asarray(grid['lat'])
+        self.NP   = len(self.lon)
+
+    #--------------------------------------------------------------------------
+    def __getitem__ ( self, key ):
+        return self.grid[key]
+
+    def __contains__ ( self, key ):
+        return key in self.grid
+
+    def keys ( self ):
+        return self.grid.keys()
+
+    #--------------------------------------------------------------------------
+    @cached_property
+    def elements ( self ):
+        """
+        0-based element table [NE, 3]
+        """
+        return np.asarray(self.grid['Elements'], dtype=np.intp).reshape(-1,3) - 1
+
+    @property
+    def NE ( self ):
+        return len(self.elements)
+
+    #--------------------------------------------------------------------------
+    @cached_property
+    def nodeElements ( self ):
+        """
+        Node-to-element adjacency in CSR form (offsets, indices):
+        elements around node n are indices[offsets[n]:offsets[n+1]]
+        """
+        nodes = self.elements.ravel()
+        elems = np.repeat(np.arange(self.NE), 3)
+        return _csr(nodes, elems, self.NP)
+
+    #--------------------------------------------------------------------------
+    @cached_property
+    def _edgeCounts ( self ):
+        e = self.elements
+        pairs = np.vstack((e[:,[0,1]], e[:,[1,2]], e[:,[2,0]]))
+        pairs.sort(axis=1)
+        keys, counts = np.unique(pairs[:,0].astype(np.int64)*self.NP + pairs[:,1],
+                                 return_counts=True)
+        return np.column_stack((keys // self.NP, keys % self.NP)), counts
+
+    @property
+    def edges ( self ):
+        """
+        Unique edges [NEDGES, 2], with node i < node j
+        """
+        return self._edgeCounts[0]
+
+    @cached_property
+    def boundaryEdges ( self ):
+        """
+        Edges that belong to one element only [NBEDGES, 2]
+        """
+        edges, counts = self._edgeCounts
+        return edges[counts == 1]
+
+    @cached_property
+    def boundaryNodes ( self ):
+        """
+        Nodes on the mesh boundary (sorted)
+        """
+        return np.unique(self.boundaryEdges)
+
+    #--------------------------------------------------------------------------
+    @cached_property
+    def nodeNeighbors ( self ):
+        """
+        Node-to-node adjacency in CSR form (offsets, indices):
+        neighbors of node n are indices[offsets[n]:offsets[n+1]]
+        """
+        e = self.edges
+        return _csr(np.concatenate((e[:,0], e[:,1])),
+                    np.concatenate((e[:,1], e[:,0])), self.NP)
+
+    #--------------------------------------------------------------------------
+    def neighbors ( self, n ):
+        """
+        Returns nodes connected to node n by an edge
+        """
+        offsets, indices = self.nodeNeighbors
+        return indices[offsets[n]:offsets[n+1]]
+
+    def elementsAround ( self, n ):
+        """
+        Returns elements that have node n as a vertex
+        """
+        offsets, indices = self.nodeElements
+        return indices[offsets[n]:offsets[n+1]]
+
+    #--------------------------------------------------------------------------
+    @cached_property
+    def centroids ( self ):
+        """
+        Element centroids [NE, 2] (lon, lat)
+        """
+        e = self.elements
+        return np.column_stack((self.lon[e].mean(axis=1),
+                                self.lat[e].mean(axis=1)))
+
+    @cached_property
+    def areas ( self ):
+        """
+        Element areas in the units of the coordinates (e.g. degrees^2)
+        """
+        e  = self.elements
+        x0, x1, x2 = self.lon[e[:,0]], self.lon[e[:,1]], self.lon[e[:,2]]
+        y0, y1, y2 = self.lat[e[:,0]], self.lat[e[:,1]], self.lat[e[:,2]]
+        return 0.5*np.abs((x1-x0)*(y2-y0) - (x2-x0)*(y1-y0))
+
+    @cached_property
+    def datelineElements ( self ):
+        """
+        Mask of elements spanning more than 180 degrees of longitude
+        """
+        return np.ptp(self.lon[self.elements], axis=1) >= 180.0
+
+    #--------------------------------------------------------------------------
+    @cached_property
+    def pointIndex ( self ):
+        """
+        Spatial index of the nodes in the lon/lat plane
+        """
+        return spatial.PointIndex(self.lon, self.lat)
+
+    @cached_property
+    def sphereIndex ( self ):
+        """
+        Spatial index of the nodes with great circle distances
+        """
+        return spatial.PointIndex(self.lon, self.lat, geographic=True)
+
+    @cached_property
+    def elementIndex ( self ):
+        return spatial.ElementIndex(self, self.pointIndex)
+
+    #--------------------------------------------------------------------------
+    def nearestNodes ( self, lon, lat, k=1, geographic=False ):
+        """
+        Finds k nearest nodes to the points (e.g. stations).
+        Returns distances (degrees, or meters if geographic) 
+        and 0-based node numbers, see spatial.PointIndex.nearest
+        """
+        index = self.sphereIndex if geographic else self.pointIndex
+        return index.nearest(lon, lat, k)
+
+    def locate ( self, lon, lat ):
+        """
+        Finds elements containing the points and barycentric weights,
+        see spatial.ElementIndex.locate
+        """
+        return self.elementIndex.locate(lon, lat)
@@ -6,8 +6,6 @@ Created on Thu Mar 16 10:02:14 2017
 """
 import os
 import numpy as np
-from datetime import datetime
-from datetime import timedelta
 import csdllib
 import netCDF4
 import csv 
@@ -20,11 +18,15 @@ def readStations (f, fields):
     return csdllib.data.parse.csvTable (f, fields)
 
 #==============================================================================
-def readTimeSeries (ncFile, stationsList, stationsFields, ncVar = 'elev', verbose=1):
+def readTimeSeries (ncFile, stationsList, stationsFields, ncVar = 'elev', verbose=1,
+                    stations=None, dateRange=None, datetime64=False):
     """
     Reads time series of the variable stored in netCDF file.
     Requires 'stationsList' and 'stationsFields' lists, 
     as it is read by nyhops.readStations()
+    Optional 'stations' (numbers or names/NOS IDs) and 'dateRange' 
+    (datetime, datetime) limit what is read from the file.
+    'time' is returned as np.datetime64 array if datetime64 is True.
     """
     if verbose:
         csdllib.oper.sys.msg('i', 'Reading [' + ncVar + '] from ' + ncFile)
@@ -33,24 +35,34 @@ def readTimeSeries (ncFile, stationsList, stationsFields, ncVar = 'elev', verbos
         return
     
     nc  = netCDF4.Dataset( ncFile )
-    fld = nc.variables[ncVar][:]
     tim = nc.variables['time'][:]    
+    baseDate = csdllib.models.adcirc._baseDate(nc.variables['time'])
+    window   = csdllib.models.adcirc.findTimeWindow(tim, baseDate, dateRange)
+
+    if stations is None:
+        index = range(len(stationsList))
+        fld   = nc.variables[ncVar][window]
+    else:
+        names = [s [ stationsFields.index('station_name') ] + ' ' +
+                 s [ stationsFields.index('nosid') ] for s in stationsList]
+        index = csdllib.models.adcirc.findStations(names, stations)
+        # netCDF reads want increasing indices
+        unique, inverse = np.unique(index, return_inverse=True)
+        fld   = nc.variables[ncVar][window, unique][:, inverse]
+    tim = tim[window]
 
     lon      = []
     lat      = []
     stations = []
     ids      = []
-    for s in stationsList:
+    for n in index:
+        s = stationsList[n]
         lon.append ( float(  s [ stationsFields.index('lon') ]) )
         lat.append ( float(  s [ stationsFields.index('lat') ]) )
         stations.append ( s [ stationsFields.index('station_name') ] )
         ids.append ( s [ stationsFields.index('nosid') ] )
 	
-    baseDate = datetime.strptime(nc.variables['time'].base_date[0:19],
-                                 '%Y-%m-%d %H:%M:%S')
-    realtime = np.array([baseDate + 
-                         timedelta(seconds=int(tim[i])) 
-                         for i in range(len(tim))])
+    realtime = csdllib.models.adcirc._timeAxis(baseDate, tim, datetime64)
 						 
     return  {'lat'       : lat, 
 	         'lon'       : lon,
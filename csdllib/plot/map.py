@@ -91,12 +91,14 @@ def set(lonlim, latlim, coast=None, fig_w=8.0):
 def addField (grid, field, clim = [0,3], zorder=0, plotMax = False, lonlim=None, latlim=None):
     """
     Adds (unstructured) gridded field to the map
+    (grid is a csdllib.models.grid.Grid or a readGrid dict)
     """
     cs.oper.sys.msg('i','Plotting the surface.')
 
-    lon       = grid['lon']
-    lat       = grid['lat']
-    triangles = grid['Elements']
+    if not isinstance(grid, cs.models.grid.Grid):
+        grid  = cs.models.grid.Grid(grid)
+    lon       = grid.lon
+    lat       = grid.lat
     z         = field
     if len(z) != len(lon):
         cs.oper.sys.msg('e','Mesh and field sizes are not the same')
@@ -104,15 +106,11 @@ def addField (grid, field, clim = [0,3], zorder=0, plotMax = False, lonlim=None,
         cs.oper.sys.msg('e','   Mesh  length is ' + str(len(lon)))
         return
     
-    newTriangles = []
-    nboundaryTriangles = 0
-    for t in triangles-1:
-        lons = []
-        for n in range(len(t)):
-            lons.append( lon[t[n]] )
-        if np.ptp( np.asarray(lons) ) < 180.0:
-            newTriangles.append (t)
-            nboundaryTriangles += 1
+    triangles = grid.elements
+    # Skip elements across the dateline
+    keep = ~grid.datelineElements
+    newTriangles = triangles[keep]
+    nboundaryTriangles = np.count_nonzero(keep)
     cs.oper.sys.msg('i','Number of found boundary elements: ' + 
         str(len(triangles)-nboundaryTriangles))
 
@@ -124,15 +122,7 @@ def addField (grid, field, clim = [0,3], zorder=0, plotMax = False, lonlim=None,
     else:
         zmask = np.ones(len(z), dtype=bool)        
     # Set mask 
-    # TODO : Optimize this following loop
-    #
-    mask = np.ones(len(Tri.triangles), dtype=bool)
-    count = 0
-    for t in Tri.triangles:
-        count+=1
-        ind = t
-        if np.any(zmask[ind-1]):
-            mask[count-1] = False    
+    mask = ~np.any(zmask[Tri.triangles-1], axis=1)
     Tri.set_mask = mask
 
     myCmap = plt.cm.jet